@@ -3,46 +3,23 @@
 '''
 Script to create a file in every cell data folder which contains the
 name of the cell template as it appears in the HOC code so that it
-can be loaded automatically by Python.
+can be loaded automatically by Python. The names come from the shared
+model base index (neurpy.ModelIndex), so this also brings it up to date.
 '''
 
 
 import sys
 import os
-import re
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+from neurpy.ModelIndex import ModelIndex
 
 OUTPUT_FILENAME = 'cellname.txt'
 
-def dealWithCell( root, templatePath ):
-    templateStr = None
-    with open( templatePath, 'r' ) as tmplFile:
-        for line in tmplFile:
-            if( re.search( r"^begintemplate.*", line ) ):
-                line = re.sub( r"(.*begintemplate)|[\r\n]|[ ]", '', line )
-                templateStr = line.strip()
-                break
-    if not templateStr:
-        print( "Warning! Could not find template name for %s" % templatePath )
-        return
-    
-    outputPath = os.path.join( root, OUTPUT_FILENAME )
+def dealWithCell( index, cellType ):
+    outputPath = os.path.join( index.getPath( cellType, 'path' ), OUTPUT_FILENAME )
     with open( outputPath, 'w' ) as outFile:
-        outFile.write( templateStr )
-
-
-def recurseFolders( rootDir ):
-    # Check for the cell template file
-    dirListing = [ sub for sub in os.listdir( rootDir ) ]
-    templateFiles = [ os.path.join( rootDir, tmpl ) for tmpl in dirListing if re.search( r'template\.hoc', tmpl ) and os.path.isfile( os.path.join( rootDir, tmpl ) ) ]
-    if templateFiles:
-        if len( templateFiles ) != 1:
-            print( "More than 1 template file? Wat" )
-        dealWithCell( rootDir, templateFiles[ 0 ] )    
-        
-    else:
-        dirs = [ os.path.join( rootDir, dir ) for dir in dirListing if os.path.isdir( os.path.join( rootDir, dir ) ) ]
-        for dir in dirs:
-            recurseFolders( dir )
+        outFile.write( index.getTemplateName( cellType ) )
 
 
 
@@ -54,4 +31,6 @@ modelBaseDir = os.path.dirname( modelBasePath )
 
 
 
-recurseFolders( modelBaseDir )
\ No newline at end of file
+modelIndex = ModelIndex.load( modelBaseDir )
+for cellType in sorted( modelIndex.cells ):
+    dealWithCell( modelIndex, cellType )
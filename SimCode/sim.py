@@ -56,7 +56,7 @@ if not os.path.exists( logDir ):
     os.makedirs( logDir )
 
 validFiles = [ ( x, int( re.search( "[0-9]+", x )[ 0 ] ) )
-                for x in os.listdir( netDir ) if x.endswith( ".xml" ) ]
+                for x in os.listdir( netDir ) if x.endswith( ( ".xml", ".ntb" ) ) ]
 validFiles.sort( key=lambda val:val[ 1 ] )
 
 procHandles = [ None ] * numProcs
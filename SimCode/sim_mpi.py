@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+'''
+Run a single network simulation distributed over MPI ranks, e.g.
+    mpiexec -n 8 python3 SimCode/sim_mpi.py -i net.xml -o output/output-00
+'''
+
+import argparse
+import sys
+
+parser = argparse.ArgumentParser( description="Run a Neuron simulation over MPI" )
+parser.add_argument( "-i", "--input", type=str, dest="inputFile", action="store", required=True, help="Network topology file (.xml or .ntb)" )
+parser.add_argument( "-o", "--output", type=str, dest="outputBase", action="store", required=True, help="Base path of the simulation outputs" )
+parser.add_argument( "-s", "--seed", type=int, dest="seed", action="store", default=None, help="Random seed, for repeatable runs" )
+parser.add_argument( "-n", "--threads", type=int, dest="nthread", action="store", default=1, help="Threads per rank" )
+parser.add_argument( "--csv", dest="csvOutput", action="store_true", help="Write CSV outputs instead of binary ones" )
+parser.add_argument( "-t", "--tstop", type=float, dest="tstop", action="store", default=1000.0, help="Simulation length (ms)" )
+
+args = parser.parse_args()
+
+modelBaseDir = "./modelBase"
+globalMechanismsDir = "./modelBase/global_mechanisms"
+
+from neurpy.NeuronEnviron import NeuronEnviron
+import neuron
+
+netEnv = NeuronEnviron( modelBaseDir, globalMechanismsDir, seed=args.seed, parallel=True,
+                        nthread=args.nthread )
+if netEnv.rank == 0:
+    print( f"Running {args.inputFile} on {netEnv.nhost} ranks, seed {netEnv.seed}" )
+
+network = netEnv.loadTopology( args.inputFile )
+print( f"Rank {netEnv.rank}: {len( network.cellDict )} of {len( network.cellGids )} cells" )
+
+neuron.h.tstop = args.tstop
+if args.csvOutput:
+    netEnv.outputFormat = 'csv'
+netEnv.runSimulation( args.outputBase, None )
+
+netEnv.pc.barrier()
+netEnv.pc.done()
+neuron.h.quit()
+sys.exit( 0 )
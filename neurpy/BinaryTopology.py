@@ -0,0 +1,300 @@
+'''
+Compact binary form of the pseudo-GEXF network topology files.
+
+A .ntb file stores the cells, edges, stimuli and probes of a network as
+typed columns, one per attribute:
+
+    magic 'NTWB' | u32 version | u32 header length | JSON header | data
+
+The JSON header describes every column (type, byte offset, and the offset
+of its presence mask if some elements lack the attribute) along with the
+root/graph attributes and <meta> block of the source file. The data area
+holds the raw little-endian arrays, each aligned to 8 bytes. Attributes
+whose values all print back exactly as integers or floats are stored as
+int64/float64, anything else as indices into a shared string table, so
+converting XML -> binary -> XML gives back the same attribute text.
+
+Usage: python -m neurpy.BinaryTopology <input> <output>, converting
+between XML and .ntb according to the input's extension.
+'''
+import json
+import struct
+import sys
+from xml.etree.ElementTree import Element, SubElement, ElementTree, fromstring, indent
+import numpy as np
+from neurpy.TopologyLoader import iterTopology
+
+binaryExtension = '.ntb'
+magic = b'NTWB'
+version = 1
+prefixFormat = '<4sII'
+
+# Element kinds, in file order, with the XML container each lives in
+elementKinds = ( ( 'cell', 'cells' ), ( 'edge', 'edges' ),
+                 ( 'stim', 'stimuli' ), ( 'probe', 'probes' ) )
+# Names and references, always handed out as text, even if numeric
+textAttributes = ( 'id', 'source', 'target', 'tag', 'label', 'sectionLists' )
+
+
+def isBinaryTopology( filePath ):
+    return filePath.endswith( binaryExtension )
+
+
+def columnType( values ):
+    ''' Narrowest type that reproduces every value exactly when printed '''
+    try:
+        if all( str( int( val ) ) == val for val in values ):
+            return 'int'
+    except ValueError:
+        pass
+    try:
+        if all( repr( float( val ) ) == val for val in values ):
+            return 'float'
+    except ValueError:
+        pass
+    return 'str'
+
+
+class BinaryTopology( object ):
+    '''
+    Columnar network description. `tables` maps each element kind ('cell',
+    'edge', 'stim', 'probe') to a dict of column name -> ( values, present ),
+    where `present` is a bool array, or None if every element has the
+    attribute. Values are int64/float64 arrays, or for string columns an
+    int32 array of indices into `strings`.
+    '''
+    def __init__( self, tables, strings, counts, extras=None ):
+        self.tables = tables
+        self.strings = strings
+        self.counts = counts
+        self.extras = extras if extras is not None else {}
+        self.elementColumns = {}
+
+    def getColumn( self, kind, name ):
+        '''
+        Get a column as ( values, present ). String columns are decoded to
+        a list of str (None where absent).
+        '''
+        values, present = self.tables[ kind ][ name ]
+        if name in self.__stringColumns( kind ):
+            values = [ self.strings[ idx ] for idx in values.tolist() ]
+            if present is not None:
+                values = [ val if flag else None for val, flag in zip( values, present.tolist() ) ]
+        return values, present
+
+    def __stringColumns( self, kind ):
+        return self.extras.get( 'stringColumns', {} ).get( kind, () )
+
+    def iterElements( self, asText=False ):
+        '''
+        Yield ( tag, attributes ) for every element in file order. Numeric
+        attributes are given as int/float, except for names and references
+        (`textAttributes`), so read them with `TopologyLoader.getAttribute`.
+        With `asText`, every value is text, exactly as in the XML file.
+        '''
+        for kind, _ in elementKinds:
+            if self.counts.get( kind, 0 ) == 0:
+                continue
+            names, columns, masks = self.__getElementColumns( kind, asText )
+            if not masks:
+                for row in zip( *columns ):
+                    yield kind, dict( zip( names, row ) )
+                continue
+            for row, presentRow in zip( zip( *columns ), zip( *masks ) ):
+                yield kind, { name : val for name, val, present in zip( names, row, presentRow )
+                                if present }
+
+    def __getElementColumns( self, kind, asText ):
+        '''
+        Columns of an element kind as Python lists: ( names, values, presence
+        masks ), with no masks if every element has every attribute. Kept,
+        as a topology is read more than once while loading.
+        '''
+        key = ( kind, asText )
+        if key in self.elementColumns:
+            return self.elementColumns[ key ]
+        names = []
+        columns = []
+        masks = []
+        anyMissing = False
+        for name, ( values, present ) in self.tables[ kind ].items():
+            if name in self.__stringColumns( kind ):
+                column = [ self.strings[ idx ] for idx in values.tolist() ]
+            elif values.dtype == np.float64 and ( asText or name in textAttributes ):
+                column = [ repr( val ) for val in values.tolist() ]
+            elif asText or name in textAttributes:
+                column = [ str( val ) for val in values.tolist() ]
+            else:
+                column = values.tolist()
+            names.append( name )
+            columns.append( column )
+            masks.append( present.tolist() if present is not None else
+                          [ True ] * self.counts[ kind ] )
+            anyMissing = anyMissing or present is not None
+        self.elementColumns[ key ] = ( names, columns, masks if anyMissing else [] )
+        return self.elementColumns[ key ]
+
+    @staticmethod
+    def fromXml( filePath ):
+        ''' Build from a topology XML file '''
+        extras = {}
+        rows = { kind : [] for kind, _ in elementKinds }
+        for tag, attrib in iterTopology( filePath, extras ):
+            rows[ tag ].append( attrib )
+
+        strings = []
+        stringIds = {}
+        tables = {}
+        stringColumns = {}
+        for kind, _ in elementKinds:
+            kindRows = rows[ kind ]
+            names = []
+            for attrib in kindRows:
+                names.extend( name for name in attrib if name not in names )
+            tables[ kind ] = {}
+            stringColumns[ kind ] = []
+            for name in names:
+                present = np.array( [ name in attrib for attrib in kindRows ], dtype=bool )
+                rawValues = [ attrib.get( name, None ) for attrib in kindRows ]
+                valType = columnType( [ val for val in rawValues if val is not None ] )
+                if valType == 'int':
+                    values = np.array( [ int( val ) if val is not None else 0
+                                            for val in rawValues ], dtype=np.int64 )
+                elif valType == 'float':
+                    values = np.array( [ float( val ) if val is not None else np.nan
+                                            for val in rawValues ], dtype=np.float64 )
+                else:
+                    for val in rawValues:
+                        if val is not None and val not in stringIds:
+                            stringIds[ val ] = len( strings )
+                            strings.append( val )
+                    values = np.array( [ stringIds[ val ] if val is not None else -1
+                                            for val in rawValues ], dtype=np.int32 )
+                    stringColumns[ kind ].append( name )
+                tables[ kind ][ name ] = ( values, None if present.all() else present )
+
+        extras[ 'stringColumns' ] = stringColumns
+        counts = { kind : len( rows[ kind ] ) for kind, _ in elementKinds }
+        return BinaryTopology( tables, strings, counts, extras )
+
+    def toXml( self, filePath ):
+        ''' Write out as a topology XML file '''
+        extras = self.extras
+        docElement = Element( extras.get( 'root', 'Neurtwork' ),
+                              attrib=extras.get( 'rootAttrib', {} ) )
+        if extras.get( 'meta', None ):
+            docElement.append( fromstring( extras[ 'meta' ] ) )
+        graphElement = SubElement( docElement, "graph",
+                                   attrib=extras.get( 'graphAttrib',
+                                                      { "mode":"static",
+                                                        "defaultedgetype":"directed" } ) )
+        containers = {}
+        for kind, containerName in elementKinds:
+            containers[ kind ] = SubElement( graphElement, containerName )
+        for kind, attrib in self.iterElements( asText=True ):
+            SubElement( containers[ kind ], kind, attrib=attrib )
+
+        indent( docElement, space="   " )
+        ElementTree( docElement ).write( filePath, encoding="UTF-8",
+                                         xml_declaration=True )
+
+    def save( self, filePath ):
+        ''' Write out in the binary format '''
+        blocks = []
+        dataSize = 0
+
+        def addBlock( array ):
+            nonlocal dataSize
+            data = np.ascontiguousarray( array ).astype( array.dtype.newbyteorder( '<' ) ).tobytes()
+            offset = dataSize
+            padding = -len( data ) % 8
+            blocks.append( data + b'\0' * padding )
+            dataSize += len( data ) + padding
+            return offset
+
+        columns = {}
+        for kind, _ in elementKinds:
+            columns[ kind ] = []
+            for name, ( values, present ) in self.tables[ kind ].items():
+                columns[ kind ].append( {
+                    "name" : name,
+                    "dtype" : values.dtype.str,
+                    "offset" : addBlock( values ),
+                    "present" : addBlock( present.astype( np.uint8 ) )
+                                    if present is not None else None,
+                } )
+
+        encoded = [ val.encode( 'utf-8' ) for val in self.strings ]
+        stringOffsets = np.zeros( len( encoded ) + 1, dtype=np.int64 )
+        np.cumsum( [ len( val ) for val in encoded ], out=stringOffsets[ 1: ] )
+        header = {
+            "counts" : self.counts,
+            "columns" : columns,
+            "stringOffsets" : addBlock( stringOffsets ),
+            "stringData" : addBlock( np.frombuffer( b''.join( encoded ), dtype=np.uint8 ) ),
+            "numStrings" : len( encoded ),
+            "extras" : self.extras,
+        }
+        headerBytes = json.dumps( header ).encode( 'utf-8' )
+        headerBytes += b' ' * ( -( len( headerBytes ) + struct.calcsize( prefixFormat ) ) % 8 )
+
+        with open( filePath, 'wb' ) as outFile:
+            outFile.write( struct.pack( prefixFormat, magic, version, len( headerBytes ) ) )
+            outFile.write( headerBytes )
+            for block in blocks:
+                outFile.write( block )
+
+    @staticmethod
+    def load( filePath ):
+        '''
+        Read a binary topology file. Columns are views onto the file's
+        bytes; only the JSON header and the string table are decoded.
+        '''
+        with open( filePath, 'rb' ) as inFile:
+            buf = inFile.read()
+        fileMagic, fileVersion, headerLen = struct.unpack_from( prefixFormat, buf, 0 )
+        if fileMagic != magic:
+            raise ValueError( "%s is not a binary topology file" % filePath )
+        if fileVersion != version:
+            raise ValueError( "%s has unsupported version %i" % ( filePath, fileVersion ) )
+        headerStart = struct.calcsize( prefixFormat )
+        header = json.loads( buf[ headerStart : headerStart + headerLen ] )
+        dataStart = headerStart + headerLen
+        counts = header[ "counts" ]
+
+        def view( dtype, offset, count ):
+            return np.frombuffer( buf, dtype=np.dtype( dtype ), count=count,
+                                  offset=dataStart + offset )
+
+        tables = {}
+        for kind, _ in elementKinds:
+            tables[ kind ] = {}
+            for column in header[ "columns" ][ kind ]:
+                values = view( column[ "dtype" ], column[ "offset" ], counts[ kind ] )
+                present = None
+                if column[ "present" ] is not None:
+                    present = view( np.uint8, column[ "present" ], counts[ kind ] ).astype( bool )
+                tables[ kind ][ column[ "name" ] ] = ( values, present )
+
+        numStrings = header[ "numStrings" ]
+        stringOffsets = view( np.int64, header[ "stringOffsets" ], numStrings + 1 )
+        stringStart = dataStart + header[ "stringData" ]
+        strings = [ buf[ stringStart + start : stringStart + end ].decode( 'utf-8' )
+                        for start, end in zip( stringOffsets[ :-1 ].tolist(),
+                                               stringOffsets[ 1: ].tolist() ) ]
+        return BinaryTopology( tables, strings, counts, header[ "extras" ] )
+
+
+def convert( inPath, outPath ):
+    ''' Convert between XML and binary topology files, by file extension '''
+    if isBinaryTopology( inPath ):
+        BinaryTopology.load( inPath ).toXml( outPath )
+    else:
+        BinaryTopology.fromXml( inPath ).save( outPath )
+
+
+if __name__ == "__main__":
+    if len( sys.argv ) != 3:
+        print( "Usage: %s <input> <output>" % sys.argv[ 0 ] )
+        sys.exit( 1 )
+    convert( sys.argv[ 1 ], sys.argv[ 2 ] )
@@ -0,0 +1,226 @@
+'''
+Vectorised access to the 3D morphology of a cell.
+'''
+import neuron
+import numpy as np
+from neurpy.SpatialIndex import expandRanges
+
+
+def eulerToMatrix( rotation ):
+    '''
+    Build a rotation matrix from xyz Euler angles (radians). The rotations
+    are applied about x, then y, then z, i.e. R = Rz * Ry * Rx.
+    '''
+    cx, cy, cz = np.cos( rotation )
+    sx, sy, sz = np.sin( rotation )
+    return np.array( [ [ cz * cy, cz * sy * sx - sz * cx, cz * sy * cx + sz * sx ],
+                       [ sz * cy, sz * sy * sx + cz * cx, sz * sy * cx - cz * sx ],
+                       [ -sy,     cy * sx,                cy * cx                ] ] )
+
+
+def matrixToEuler( matrix ):
+    ''' Inverse of `eulerToMatrix` '''
+    sy = -matrix[ 2, 0 ]
+    if abs( sy ) < 1.0 - 1e-12:
+        rx = np.arctan2( matrix[ 2, 1 ], matrix[ 2, 2 ] )
+        ry = np.arcsin( sy )
+        rz = np.arctan2( matrix[ 1, 0 ], matrix[ 0, 0 ] )
+    else:
+        # Gimbal lock, only rx + rz (or rx - rz) is defined
+        rx = np.arctan2( -matrix[ 1, 2 ], matrix[ 1, 1 ] )
+        ry = np.copysign( np.pi / 2.0, sy )
+        rz = 0.0
+    return [ float( rx ), float( ry ), float( rz ) ]
+
+
+def asRotationMatrix( rotation ):
+    ''' Accept either xyz Euler angles or a 3x3 matrix '''
+    rotation = np.asarray( rotation, dtype=np.float64 )
+    if rotation.shape == ( 3, 3 ):
+        return rotation
+    return eulerToMatrix( rotation )
+
+
+class CellGeometry( object ):
+    '''
+    Snapshot of the 3D points of every section of a cell, held in NumPy
+    arrays so that bounding boxes and translations don't need a hoc call
+    per point.
+
+    `points` is an (N, 3) array of xyz coordinates and `diams` holds the
+    matching diameters. The points of `sections[ i ]` are found at
+    `points[ offsets[ i ] : offsets[ i + 1 ] ]`. Changes made to the arrays
+    are written back to NEURON with `commit`.
+    '''
+    def __init__( self, neurCell ):
+        self.sections = [ sec for sec in neurCell.all ]
+        self.sectionIndices = { sec.name() : i for i, sec in enumerate( self.sections ) }
+        self.points = None
+        self.diams = None
+        self.offsets = None
+        self.bounds = None
+        self.arcLengths = None
+        self.load()
+
+    def load( self ):
+        ''' Pull the 3D points of every section out of NEURON '''
+        counts = [ int( neuron.h.n3d( sec=sec ) ) for sec in self.sections ]
+        self.offsets = np.zeros( len( counts ) + 1, dtype=np.int64 )
+        np.cumsum( counts, out=self.offsets[ 1: ] )
+
+        numPoints = int( self.offsets[ -1 ] )
+        self.points = np.empty( ( numPoints, 3 ) )
+        self.diams = np.empty( numPoints )
+        for sec, start, count in zip( self.sections, self.offsets, counts ):
+            for i in range( count ):
+                self.points[ start + i ] = ( neuron.h.x3d( i, sec=sec ),
+                                             neuron.h.y3d( i, sec=sec ),
+                                             neuron.h.z3d( i, sec=sec ) )
+                self.diams[ start + i ] = neuron.h.diam3d( i, sec=sec )
+        self.bounds = None
+        self.arcLengths = None
+
+    def commit( self ):
+        ''' Write the current points back to the NEURON sections '''
+        for secIdx, sec in enumerate( self.sections ):
+            start = self.offsets[ secIdx ]
+            end = self.offsets[ secIdx + 1 ]
+            if start == end:
+                continue
+            secPoints = self.points[ start : end ]
+            neuron.h.pt3dclear( sec=sec )
+            neuron.h.pt3dadd( neuron.h.Vector( secPoints[ :, 0 ] ),
+                              neuron.h.Vector( secPoints[ :, 1 ] ),
+                              neuron.h.Vector( secPoints[ :, 2 ] ),
+                              neuron.h.Vector( self.diams[ start : end ] ),
+                              sec=sec )
+
+    def getSectionIndex( self, sec ):
+        ''' Position of a section in `sections` '''
+        return self.sectionIndices[ sec.name() ]
+
+    def getSectionPoints( self, secIndices ):
+        ''' All points of the given sections, stacked '''
+        secIndices = np.asarray( secIndices, dtype=np.int64 )
+        starts = self.offsets[ secIndices ]
+        return self.points[ expandRanges( starts, self.offsets[ secIndices + 1 ] - starts ) ]
+
+    def getArcLengths( self ):
+        '''
+        Distance of each point along its section from the section's first
+        point. Rigid transforms leave these unchanged, so they're only
+        computed once per load.
+        '''
+        if self.arcLengths is None:
+            steps = np.zeros( len( self.points ) )
+            steps[ 1: ] = np.linalg.norm( np.diff( self.points, axis=0 ), axis=1 )
+            # Don't carry distance over from the previous section
+            steps[ self.offsets[ :-1 ][ self.offsets[ :-1 ] < len( steps ) ] ] = 0.0
+            cumulative = np.cumsum( steps )
+            secIdx = np.repeat( np.arange( len( self.sections ) ),
+                                np.diff( self.offsets ) )
+            self.arcLengths = cumulative - cumulative[ self.offsets[ secIdx ] ]
+        return self.arcLengths
+
+    def interpolate( self, secIndices, xs ):
+        '''
+        Get the xyz positions at normalised distances `xs` along sections
+        `secIndices`, as used to place point processes with sec( x ).
+        Positions on sections without 3D points are NaN.
+        '''
+        secIndices = np.asarray( secIndices, dtype=np.int64 )
+        xs = np.clip( np.asarray( xs, dtype=np.float64 ), 0.0, 1.0 )
+        positions = np.full( ( len( secIndices ), 3 ), np.nan )
+        if len( secIndices ) == 0:
+            return positions
+
+        arc = self.getArcLengths()
+        starts = self.offsets[ secIndices ]
+        lasts = self.offsets[ secIndices + 1 ] - 1
+        valid = lasts >= starts
+        starts, lasts, xs = starts[ valid ], lasts[ valid ], xs[ valid ]
+
+        # Offset each section's arc lengths so the whole array is increasing,
+        # then a single searchsorted finds the enclosing pair of points
+        secLengths = arc[ self.offsets[ 1: ] - 1 ] if len( arc ) else np.zeros( 0 )
+        secLengths = np.where( np.diff( self.offsets ) > 0, secLengths, 0.0 )
+        bases = np.concatenate( ( [ 0.0 ], np.cumsum( secLengths + 1.0 ) ) )
+        pointBases = np.repeat( bases[ :-1 ], np.diff( self.offsets ) )
+        globalArc = arc + pointBases
+
+        targets = pointBases[ starts ] + xs * arc[ lasts ]
+        lower = np.searchsorted( globalArc, targets, side='right' ) - 1
+        lower = np.clip( lower, starts, np.maximum( lasts - 1, starts ) )
+        upper = np.minimum( lower + 1, lasts )
+        span = globalArc[ upper ] - globalArc[ lower ]
+        frac = np.divide( targets - globalArc[ lower ], span,
+                          out=np.zeros_like( span ), where=span > 0 )
+        positions[ valid ] = self.points[ lower ] + \
+                             frac[ :, None ] * ( self.points[ upper ] - self.points[ lower ] )
+        return positions
+
+    def getBounds( self ):
+        '''
+        Get the ( min, max ) corners of the bounding box as xyz arrays.
+        The box is computed once and then kept in step with translations.
+        '''
+        if self.bounds is None:
+            if len( self.points ) == 0:
+                self.bounds = ( np.zeros( 3 ), np.zeros( 3 ) )
+            else:
+                self.bounds = ( self.points.min( axis=0 ),
+                                self.points.max( axis=0 ) )
+        return self.bounds
+
+    def getSize( self ):
+        ''' Get the bounding-box dimensions '''
+        minPos, maxPos = self.getBounds()
+        return tuple( float( x ) for x in maxPos - minPos )
+
+    def translate( self, translation ):
+        ''' Translate all points by an xyz offset and write them back '''
+        translation = np.asarray( translation, dtype=np.float64 )
+        self.points += translation
+        if self.bounds is not None:
+            self.bounds = ( self.bounds[ 0 ] + translation,
+                            self.bounds[ 1 ] + translation )
+        self.commit()
+
+    def transform( self, matrix, translation=( 0.0, 0.0, 0.0 ),
+                   origin=( 0.0, 0.0, 0.0 ) ):
+        '''
+        Rotate all points by `matrix` about `origin`, then translate them,
+        and write them back.
+        '''
+        CellGeometry.transformMany( [ self ], [ matrix ], [ translation ],
+                                    [ origin ] )
+
+    @staticmethod
+    def transformMany( geometries, matrices, translations, origins ):
+        '''
+        Apply a rigid transform to each of a batch of geometries, rotating
+        geometry i by `matrices[ i ]` about `origins[ i ]` and then moving it
+        by `translations[ i ]`. The points of the whole batch are stacked so
+        the arithmetic is done in one pass before each geometry is committed
+        back to NEURON.
+        '''
+        if not geometries:
+            return
+        counts = [ len( geom.points ) for geom in geometries ]
+        ends = np.cumsum( counts )
+        starts = ends - counts
+        allPoints = np.concatenate( [ geom.points for geom in geometries ] )
+
+        # p' = R ( p - o ) + o + t, which is p R^T plus a per-cell offset
+        matrices = np.asarray( matrices, dtype=np.float64 )
+        origins = np.asarray( origins, dtype=np.float64 )
+        offsets = ( origins + np.asarray( translations, dtype=np.float64 ) -
+                    np.einsum( 'nij,nj->ni', matrices, origins ) )
+        for i, ( start, end ) in enumerate( zip( starts, ends ) ):
+            allPoints[ start : end ] = allPoints[ start : end ] @ matrices[ i ].T
+        allPoints += np.repeat( offsets, counts, axis=0 )
+
+        for geom, start, end in zip( geometries, starts, ends ):
+            geom.points = allPoints[ start : end ]
+            geom.bounds = None
+            geom.commit()
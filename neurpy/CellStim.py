@@ -2,17 +2,60 @@ import neuron
 import random
 
 class CellStim:
+    '''
+    A NetStim driving synapses of a cell, switched on and off by symbols.
+    The NetStim runs freely, as it always has; its spikes pass through a
+    relay (an IntFire1 that fires on every input above threshold) which
+    fans out to the synapses. Switching only sets the weight of the one
+    NetCon from the NetStim to the relay, so it costs the same whatever the
+    number of synapses driven, and never restarts the NetStim's sequence.
+    The stimulus starts off at each initialisation; while on, every
+    synapse gets the configured weight.
+
+    Once attached to a StimulusEngine, the symbol probability and history
+    live in the engine's arrays and `updateStimulus` is done in batches by
+    the engine.
+    '''
 
     def __init__( self ):
         self.netstim = None
         self.netcons = []
         self.active = False
-        self.symbolProbability = 1.0
-        self.activeHistory = []
+        self.engine = None
+        self.slot = None
+        self.__symbolProbability = 1.0
+        self.__activeHistory = []
+        self.relay = None
+        self.gate = None
+        self.initHandler = None
+        self.playback = None
         self.interval = 100
         self.weight = 1.0
         self.delay = 0.0
 
+    def attachEngine( self, engine, slot ):
+        self.engine = engine
+        self.slot = slot
+
+    @property
+    def symbolProbability( self ):
+        if self.engine is not None:
+            return float( self.engine.probabilities[ self.slot ] )
+        return self.__symbolProbability
+
+    @symbolProbability.setter
+    def symbolProbability( self, probability ):
+        if self.engine is not None:
+            self.engine.probabilities[ self.slot ] = probability
+        else:
+            self.__symbolProbability = probability
+
+    @property
+    def activeHistory( self ):
+        if self.engine is not None:
+            return self.engine.getHistory( self.slot )
+        return self.__activeHistory
+
     def setProperties( self, weight=None, delay=None, interval=None ):
         self.interval = interval
         self.delay = delay
@@ -31,26 +74,51 @@ class CellStim:
         netstim.noise = 1
         self.netstim = netstim
 
+        # Any input with weight > 1 makes the relay fire at once; with no
+        # refractory period it doesn't miss any spike
+        self.relay = neuron.h.IntFire1()
+        self.relay.refrac = 0
+        self.gate = neuron.h.NetCon( netstim, self.relay )
+        self.gate.delay = 0
+        self.gate.weight[ 0 ] = 0.0
+        self.initHandler = neuron.h.FInitializeHandler( self.__initialise )
+
+    def __initialise( self ):
+        # Off until a symbol turns it on; a schedule starts from off itself
+        self.active = False
+        if self.playback is None:
+            self.gate.weight[ 0 ] = 0.0
+
     def connectToSynapse( self, synapse ):
-        netcon = neuron.h.NetCon( self.netstim, synapse )
+        netcon = neuron.h.NetCon( self.relay, synapse )
         netcon.delay = self.delay
         netcon.weight[ 0 ] = self.weight
         self.netcons.append( netcon )
 
 
     def setActive( self, active ):
-        if active and not self.active:
-            for netcon in self.netcons:
-                netcon.weight[ 0 ] = 1.0
-            self.active = True
-            return 0
-        elif not active and self.active:
-            for netcon in self.netcons:
-                netcon.weight[ 0 ] = 0.0
-            self.active = False
-            return 0
-        else:
+        if active == self.active:
             return 1
+        self.gate.weight[ 0 ] = 2.0 if active else 0.0
+        self.active = active
+        return 0
+
+    def playActive( self, times, states ):
+        '''
+        Have NEURON switch the stimulus on or off at the given times during
+        the next run, replacing any earlier schedule, by playing the gate
+        weight
+        '''
+        if self.playback is not None:
+            self.playback[ 1 ].play_remove()
+            self.playback = None
+        self.gate.weight[ 0 ] = 0.0
+        if len( times ) == 0:
+            return
+        timeVec = neuron.h.Vector( [ float( time ) for time in times ] )
+        weightVec = neuron.h.Vector( [ 2.0 if state else 0.0 for state in states ] )
+        weightVec.play( self.gate._ref_weight[ 0 ], timeVec )
+        self.playback = ( timeVec, weightVec )
 
     def updateStimulus( self ):
         
@@ -62,5 +130,5 @@ class CellStim:
         elif self.symbolProbability <= gProb and self.active:
             # Disable stim
             self.setActive( False )
-        self.activeHistory.append( int( self.active ) )
+        self.__activeHistory.append( int( self.active ) )
 
@@ -0,0 +1,231 @@
+'''
+Compact, array-backed connectivity of a network's cells.
+'''
+from array import array
+import numpy as np
+from neurpy.SpatialIndex import expandRanges
+
+
+class EdgeView( object ):
+    ''' Read-only view of one edge of a Connectivity '''
+    __slots__ = ( 'connectivity', 'edgeId' )
+
+    def __init__( self, connectivity, edgeId ):
+        self.connectivity = connectivity
+        self.edgeId = edgeId
+
+    @property
+    def source( self ):
+        return self.connectivity.cellIds[ self.connectivity.sources[ self.edgeId ] ]
+
+    @property
+    def target( self ):
+        return self.connectivity.cellIds[ self.connectivity.targets[ self.edgeId ] ]
+
+    @property
+    def delay( self ):
+        return float( self.connectivity.delays[ self.edgeId ] )
+
+    @property
+    def weight( self ):
+        return float( self.connectivity.weights[ self.edgeId ] )
+
+    @property
+    def synType( self ):
+        return int( self.connectivity.synTypes[ self.edgeId ] )
+
+    @property
+    def connCount( self ):
+        return int( self.connectivity.connCounts[ self.edgeId ] )
+
+    @property
+    def netCons( self ):
+        return self.connectivity.getNetCons( self.edgeId )
+
+
+class Connectivity( object ):
+    '''
+    Edges between cells, stored as columns indexed by edge ID (the order
+    edges were added in): `sources`, `targets` (cell indices), `delays`,
+    `weights`, `synTypes` and `connCounts`. The NetCons of each edge are
+    kept in one flat list, edge by edge.
+
+    Cells are referred to by their ID in the topology file; `cellIds`
+    gives the ID of each cell index. Compressed sparse row indices by
+    source and by target are built on first query, so degrees and
+    neighbours come from slices rather than searches.
+
+    For compatibility `connectivity[ source ][ target ]` gives an EdgeView
+    of the (last added) edge between two cells.
+    '''
+    def __init__( self ):
+        self.cellIds = []
+        self.cellIndex = {}
+        self.__sources = array( 'i' )
+        self.__targets = array( 'i' )
+        self.__delays = array( 'd' )
+        self.__weights = array( 'd' )
+        self.__synTypes = array( 'i' )
+        self.__connCounts = array( 'i' )
+        self.__netConStarts = array( 'q', [ 0 ] )
+        self.netConList = []
+        self.__columns = None
+        self.__indices = None
+
+    def __len__( self ):
+        return len( self.__sources )
+
+    def addCell( self, cellId ):
+        ''' Register a cell, returning its index '''
+        idx = self.cellIndex.get( cellId, None )
+        if idx is None:
+            idx = len( self.cellIds )
+            self.cellIndex[ cellId ] = idx
+            self.cellIds.append( cellId )
+            self.__indices = None
+        return idx
+
+    def addEdge( self, source, target, delay, weight, synType, connCount,
+                 netCons=() ):
+        ''' Add an edge between two registered cells, returning its ID '''
+        edgeId = len( self.__sources )
+        self.__sources.append( self.cellIndex[ source ] )
+        self.__targets.append( self.cellIndex[ target ] )
+        self.__delays.append( delay )
+        self.__weights.append( weight )
+        self.__synTypes.append( synType )
+        self.__connCounts.append( connCount )
+        self.netConList.extend( netCons )
+        self.__netConStarts.append( len( self.netConList ) )
+        self.__columns = None
+        self.__indices = None
+        return edgeId
+
+    def __getColumns( self ):
+        if self.__columns is None:
+            self.__columns = {
+                'sources' : np.array( self.__sources, dtype=np.int32 ),
+                'targets' : np.array( self.__targets, dtype=np.int32 ),
+                'delays' : np.array( self.__delays, dtype=np.float64 ),
+                'weights' : np.array( self.__weights, dtype=np.float64 ),
+                'synTypes' : np.array( self.__synTypes, dtype=np.int32 ),
+                'connCounts' : np.array( self.__connCounts, dtype=np.int32 ),
+                'netConStarts' : np.array( self.__netConStarts, dtype=np.int64 ),
+            }
+        return self.__columns
+
+    sources = property( lambda self: self.__getColumns()[ 'sources' ] )
+    targets = property( lambda self: self.__getColumns()[ 'targets' ] )
+    delays = property( lambda self: self.__getColumns()[ 'delays' ] )
+    weights = property( lambda self: self.__getColumns()[ 'weights' ] )
+    synTypes = property( lambda self: self.__getColumns()[ 'synTypes' ] )
+    connCounts = property( lambda self: self.__getColumns()[ 'connCounts' ] )
+
+    def __getIndices( self ):
+        '''
+        ( outPtr, outEdges, inPtr, inEdges ): the edges leaving cell i are
+        outEdges[ outPtr[ i ] : outPtr[ i + 1 ] ], likewise for arriving
+        '''
+        if self.__indices is None:
+            numCells = len( self.cellIds )
+            indices = []
+            for cells in ( self.sources, self.targets ):
+                order = np.argsort( cells, kind='stable' )
+                ptr = np.zeros( numCells + 1, dtype=np.int64 )
+                np.cumsum( np.bincount( cells, minlength=numCells ), out=ptr[ 1: ] )
+                indices.extend( ( ptr, order ) )
+            self.__indices = tuple( indices )
+        return self.__indices
+
+    def outDegree( self, cellId=None ):
+        ''' Number of edges leaving a cell, or an array for every cell '''
+        outPtr = self.__getIndices()[ 0 ]
+        if cellId is None:
+            return np.diff( outPtr )
+        idx = self.cellIndex[ cellId ]
+        return int( outPtr[ idx + 1 ] - outPtr[ idx ] )
+
+    def inDegree( self, cellId=None ):
+        ''' Number of edges arriving at a cell, or an array for every cell '''
+        inPtr = self.__getIndices()[ 2 ]
+        if cellId is None:
+            return np.diff( inPtr )
+        idx = self.cellIndex[ cellId ]
+        return int( inPtr[ idx + 1 ] - inPtr[ idx ] )
+
+    def outEdges( self, cellId ):
+        ''' IDs of the edges leaving a cell, in the order they were added '''
+        outPtr, outEdges = self.__getIndices()[ 0 : 2 ]
+        idx = self.cellIndex[ cellId ]
+        return outEdges[ outPtr[ idx ] : outPtr[ idx + 1 ] ]
+
+    def inEdges( self, cellId ):
+        ''' IDs of the edges arriving at a cell, in the order they were added '''
+        inPtr, inEdges = self.__getIndices()[ 2 : 4 ]
+        idx = self.cellIndex[ cellId ]
+        return inEdges[ inPtr[ idx ] : inPtr[ idx + 1 ] ]
+
+    def successors( self, cellId ):
+        ''' IDs of the cells this cell connects to '''
+        targets = np.unique( self.targets[ self.outEdges( cellId ) ] )
+        return [ self.cellIds[ idx ] for idx in targets.tolist() ]
+
+    def predecessors( self, cellId ):
+        ''' IDs of the cells connecting to this cell '''
+        sources = np.unique( self.sources[ self.inEdges( cellId ) ] )
+        return [ self.cellIds[ idx ] for idx in sources.tolist() ]
+
+    def reachable( self, cellIds, reverse=False ):
+        '''
+        IDs of the cells reachable from the given ones by following edges
+        (backwards if `reverse`), including the given cells, in cell order
+        '''
+        indices = self.__getIndices()
+        ptr, edges = indices[ 2 : 4 ] if reverse else indices[ 0 : 2 ]
+        ends = self.sources if reverse else self.targets
+        seen = np.zeros( len( self.cellIds ), dtype=bool )
+        frontier = np.unique( np.array( [ self.cellIndex[ cellId ] for cellId in cellIds ],
+                                        dtype=np.int64 ) )
+        while len( frontier ):
+            seen[ frontier ] = True
+            edgeIds = edges[ expandRanges( ptr[ frontier ], ptr[ frontier + 1 ] - ptr[ frontier ] ) ]
+            frontier = np.unique( ends[ edgeIds ] )
+            frontier = frontier[ ~seen[ frontier ] ]
+        return [ self.cellIds[ idx ] for idx in np.flatnonzero( seen ).tolist() ]
+
+    def getEdge( self, source, target ):
+        ''' View of the last added edge from source to target, or None '''
+        edgeIds = self.outEdges( source )
+        matches = edgeIds[ self.targets[ edgeIds ] == self.cellIndex[ target ] ]
+        if len( matches ) == 0:
+            return None
+        return EdgeView( self, int( matches[ -1 ] ) )
+
+    def getNetCons( self, edgeId ):
+        ''' NetCons made for an edge; empty where the target isn't local '''
+        starts = self.__getColumns()[ 'netConStarts' ]
+        return self.netConList[ starts[ edgeId ] : starts[ edgeId + 1 ] ]
+
+    def __getitem__( self, source ):
+        ''' { target ID : EdgeView } of the edges leaving a cell '''
+        return { self.cellIds[ self.targets[ edgeId ] ] : EdgeView( self, int( edgeId ) )
+                    for edgeId in self.outEdges( source ).tolist() }
+
+    def subgraph( self, cellIds ):
+        '''
+        Connectivity of the given cells and the edges between them, without
+        NetCons. Returns ( connectivity, IDs of the kept edges here ).
+        '''
+        sub = Connectivity()
+        keep = np.zeros( len( self.cellIds ), dtype=bool )
+        for cellId in cellIds:
+            keep[ self.cellIndex[ cellId ] ] = True
+        for idx in np.flatnonzero( keep ).tolist():
+            sub.addCell( self.cellIds[ idx ] )
+        edgeIds = np.flatnonzero( keep[ self.sources ] & keep[ self.targets ] )
+        for edgeId in edgeIds.tolist():
+            sub.addEdge( self.cellIds[ self.sources[ edgeId ] ],
+                         self.cellIds[ self.targets[ edgeId ] ],
+                         self.delays[ edgeId ], self.weights[ edgeId ],
+                         self.synTypes[ edgeId ], self.connCounts[ edgeId ] )
+        return sub, edgeIds
@@ -0,0 +1,90 @@
+'''
+Stimuli played back from memory-mapped .npy files.
+'''
+import os
+import numpy as np
+import neuron
+
+stimulusKinds = ( 'spikes', 'current' )
+# Libraries mapped so far, by real path
+loadedLibraries = {}
+
+
+def loadStimulusLibrary( path ):
+    '''
+    Memory-map a .npy stimulus library, once per process. Pages are only
+    read as trains are used, and are shared with every other simulation
+    mapping the same file.
+    '''
+    key = os.path.realpath( path )
+    library = loadedLibraries.get( key, None )
+    if library is None:
+        library = np.load( path, mmap_mode='r' )
+        if library.ndim not in ( 1, 2 ):
+            raise ValueError( "%s: Stimulus library must be 1D or 2D, not %iD"
+                              % ( path, library.ndim ) )
+        loadedLibraries[ key ] = library
+    return library
+
+
+def getTrain( library, index ):
+    '''
+    One train of a library: all of a 1D library, otherwise row `index`
+    without its NaN padding
+    '''
+    train = library if library.ndim == 1 else library[ index ]
+    train = np.asarray( train, dtype=np.float64 )
+    return train[ ~np.isnan( train ) ]
+
+
+class FileStimulus( object ):
+    '''
+    A stimulus whose input is read from a file. 'spikes' trains are spike
+    times (ms), delivered to synapses through a VecStim; 'current' trains
+    are IClamp amplitudes (nA) sampled every `dt` ms. Times are relative
+    to `delay`, and input after `delay + dur` is dropped.
+
+    A library file holds one train (1D) or one per row (2D, rows padded
+    with NaN), picked by `index`.
+    '''
+    def __init__( self, target, path, kind='spikes', index=0, delay=0.0,
+                  dur=1e9, dt=0.1 ):
+        if kind not in stimulusKinds:
+            raise ValueError( "Unknown stimulus type '%s', expected one of %s"
+                              % ( kind, ", ".join( stimulusKinds ) ) )
+        self.target = target
+        self.path = path
+        self.kind = kind
+        self.netcons = []
+        self.source = None
+        self.iclamp = None
+
+        train = getTrain( loadStimulusLibrary( path ), index )
+        if kind == 'spikes':
+            if not hasattr( neuron.h, 'VecStim' ):
+                raise RuntimeError( "VecStim is not available; add vecevent.mod "
+                                    "to the mechanisms and rebuild them" )
+            times = np.sort( train ) + delay
+            self.times = neuron.h.Vector( times[ times <= delay + dur ] )
+            self.source = neuron.h.VecStim()
+            self.source.play( self.times )
+        else:
+            numSamples = min( len( train ), int( np.floor( dur / dt ) ) )
+            # Back to no current once the waveform is over
+            amps = np.append( train[ 0 : numSamples ], 0.0 )
+            self.times = neuron.h.Vector( delay + dt * np.arange( len( amps ) ) )
+            self.amps = neuron.h.Vector( amps )
+
+    def connectToSynapse( self, synapse, weight=1.0, delay=0.0 ):
+        ''' Deliver the spike train to a synapse '''
+        netcon = neuron.h.NetCon( self.source, synapse )
+        netcon.weight[ 0 ] = weight
+        netcon.delay = delay
+        self.netcons.append( netcon )
+
+    def injectAt( self, segment ):
+        ''' Inject the current waveform at a segment '''
+        self.iclamp = neuron.h.IClamp( segment )
+        self.iclamp.delay = 0
+        self.iclamp.dur = 1e9
+        self.amps.play( self.iclamp._ref_amp, self.times )
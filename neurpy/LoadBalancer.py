@@ -0,0 +1,173 @@
+'''
+Cost estimates for cells, and placement of cells on ranks and threads.
+'''
+import heapq
+import os
+import numpy as np
+import neuron
+from neurpy.SynapseTable import SynapseTable
+from neurpy.ModelIndex import findMorphology, countMorphologyPoints, countMechanisms
+from neurpy.TopologyLoader import getAttribute
+
+def balanceLoads( costs, numBins ):
+    '''
+    Assign items to bins so as to keep the largest bin load low, placing
+    the costliest items first, each on the currently lightest bin (the LPT
+    rule; within 4/3 of the best possible maximum). Ties keep item order.
+    Returns ( bin of each item, load of each bin ).
+    '''
+    costs = np.asarray( costs, dtype=np.float64 )
+    assignment = np.zeros( len( costs ), dtype=np.int64 )
+    loads = np.zeros( max( numBins, 1 ) )
+    heap = [ ( 0.0, binIdx ) for binIdx in range( len( loads ) ) ]
+    for item in np.argsort( -costs, kind='stable' ):
+        load, binIdx = heapq.heappop( heap )
+        assignment[ item ] = binIdx
+        loads[ binIdx ] = load + costs[ item ]
+        heapq.heappush( heap, ( loads[ binIdx ], binIdx ) )
+    return assignment, loads
+
+
+def imbalance( loads ):
+    ''' Ratio of the largest load to the mean load (1.0 is perfect) '''
+    loads = np.asarray( loads, dtype=np.float64 )
+    mean = loads.mean() if len( loads ) else 0.0
+    return float( loads.max() / mean ) if mean > 0 else 1.0
+
+
+class LoadBalancer( object ):
+    '''
+    Estimates the relative cost of simulating each cell from its type's
+    files in the model base, and spreads cells over ranks or threads to
+    minimise the most loaded one.
+
+    A cell's cost is its estimated compartment count, scaled up by the
+    mechanisms in each compartment, plus a cost per instantiated synapse.
+    Compartments are estimated from the morphology's sample points, since
+    cells aren't built yet when placement is decided. The weights are
+    class attributes, for tuning against measured step times. With a
+    ModelIndex, the counts are taken from it rather than from the files.
+    '''
+    compartmentCost = 1.0
+    mechanismCost = 0.5
+    synapseCost = 2.0
+    pointsPerCompartment = 4.0
+
+    def __init__( self, modelRoot, modelIndex=None ):
+        self.modelRoot = modelRoot
+        self.modelIndex = modelIndex
+        self.typeCosts = {}
+        self.rankLoads = None
+        self.threadLoads = None
+
+    def getTypeCost( self, cellType ):
+        '''
+        Get ( compartment estimate, mechanisms per compartment, synapse
+        table ) for a cell type, computed once per type
+        '''
+        typeCost = self.typeCosts.get( cellType, None )
+        if typeCost is None:
+            cellRoot = os.path.join( self.modelRoot, cellType )
+            synapsePath = os.path.join( cellRoot, "synapses/synapses.tsv" )
+            if self.modelIndex is not None and cellType in self.modelIndex:
+                entry = self.modelIndex.getEntry( cellType )
+                points = entry[ 'morphologyPoints' ]
+                mechanisms = entry[ 'mechanisms' ]
+                synapsePath = self.modelIndex.getPath( cellType, 'synapseFile' ) or synapsePath
+            else:
+                morphPath = findMorphology( cellRoot )
+                points = countMorphologyPoints( morphPath ) if morphPath else 0
+                biophysPath = os.path.join( cellRoot, "biophysics.hoc" )
+                mechanisms = countMechanisms( biophysPath ) if os.path.isfile( biophysPath ) else 0.0
+            compartments = max( 1.0, points / LoadBalancer.pointsPerCompartment )
+            table = SynapseTable.load( synapsePath )
+            typeCost = ( compartments, mechanisms, table )
+            self.typeCosts[ cellType ] = typeCost
+        return typeCost
+
+    def estimateCost( self, cellType, numSynapses ):
+        ''' Relative cost of a cell of the given type with `numSynapses` in use '''
+        compartments, mechanisms, _ = self.getTypeCost( cellType )
+        return ( compartments * ( LoadBalancer.compartmentCost +
+                                  mechanisms * LoadBalancer.mechanismCost ) +
+                 numSynapses * LoadBalancer.synapseCost )
+
+    def estimateTopology( self, elements ):
+        '''
+        Estimate the cost of every cell of a network from its topology
+        elements, as ( tag, attributes ) pairs. Counts the synapses each
+        cell will instantiate: the candidates picked for incoming edges,
+        and the `fanIn` synapses of each stimulus (by default every
+        excitatory synapse of the target).
+        Returns ( cell IDs, costs ) in file order.
+        '''
+        cellIds = []
+        cellTypes = {}
+        numSynapses = {}
+        stimSynapses = {}
+        for tag, attrib in elements:
+            if tag == 'cell':
+                cellIds.append( attrib[ 'id' ] )
+                cellTypes[ attrib[ 'id' ] ] = attrib[ 'cellType' ]
+            elif tag == 'edge':
+                target = attrib[ 'target' ]
+                table = self.getTypeCost( cellTypes[ target ] )[ 2 ]
+                available = len( table.getIndices( getAttribute( attrib, 'connType', int, 0 ) ) )
+                requested = 4 * getAttribute( attrib, 'connCount', int, 0 )
+                numSynapses[ target ] = numSynapses.get( target, 0 ) + min( requested, available )
+            elif tag == 'stim':
+                target = attrib[ 'target' ]
+                table = self.getTypeCost( cellTypes[ target ] )[ 2 ]
+                fanIn = getAttribute( attrib, 'fanIn', int, len( table.excIndices ) )
+                # Stimuli may share synapses, but can't use more than exist
+                stimSynapses[ target ] = min( stimSynapses.get( target, 0 ) + fanIn,
+                                              len( table.excIndices ) )
+
+        costs = np.zeros( len( cellIds ) )
+        for idx, cellId in enumerate( cellIds ):
+            table = self.getTypeCost( cellTypes[ cellId ] )[ 2 ]
+            synCount = numSynapses.get( cellId, 0 ) + stimSynapses.get( cellId, 0 )
+            costs[ idx ] = self.estimateCost( cellTypes[ cellId ],
+                                              min( synCount, len( table ) ) )
+        return cellIds, costs
+
+    def assignRanks( self, costs, nhost ):
+        ''' Rank of each cell, from its estimated cost '''
+        assignment, self.rankLoads = balanceLoads( costs, nhost )
+        return assignment
+
+    def assignThreads( self, pc, cells, costs, nthread ):
+        '''
+        Split this rank's cells over `nthread` threads, giving each thread
+        the root sections of its cells through ParallelContext.partition
+        '''
+        assignment, self.threadLoads = balanceLoads( costs, nthread )
+        pc.nthread( nthread )
+        for thread in range( nthread ):
+            sectionList = neuron.h.SectionList()
+            for cell, cellThread in zip( cells, assignment ):
+                if cellThread == thread:
+                    root = neuron.h.SectionRef( sec=cell.neurCell.soma[ 0 ] ).root
+                    sectionList.append( sec=root )
+            pc.partition( thread, sectionList )
+        return assignment
+
+    def report( self, pc ):
+        '''
+        Print the predicted imbalance of the placement next to the one
+        measured in the last run, from each rank's computation time
+        (ParallelContext.step_time) and each thread's (thread_ctime)
+        '''
+        rank = int( pc.id() )
+        if self.rankLoads is not None:
+            stepTime = pc.step_time()
+            maxTime = pc.allreduce( stepTime, 2 )
+            meanTime = pc.allreduce( stepTime, 1 ) / pc.nhost()
+            achieved = maxTime / meanTime if meanTime > 0 else 1.0
+            if rank == 0:
+                print( "Rank load imbalance: predicted %.3f, achieved %.3f"
+                        % ( imbalance( self.rankLoads ), achieved ) )
+        if self.threadLoads is not None:
+            threadTimes = [ pc.thread_ctime( thread ) for thread in range( len( self.threadLoads ) ) ]
+            print( "Rank %i thread load imbalance: predicted %.3f, achieved %.3f"
+                    % ( rank, imbalance( self.threadLoads ), imbalance( threadTimes ) ) )
@@ -0,0 +1,248 @@
+'''
+Index of the cell types in a model base, cached between runs.
+'''
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import numpy as np
+
+indexVersion = 1
+morphologyExtensions = ( '.asc', '.swc' )
+templatePattern = re.compile( r'template\.hoc' )
+# A sample point of a Neurolucida file, "( x y z d )"
+ascPointPattern = re.compile( r'^\s*\(\s*-?[\d.]+(?:[eE][-+]?\d+)?(?:\s+-?[\d.]+(?:[eE][-+]?\d+)?){3}' )
+forsecPattern = re.compile( r'forsec\s+\$o1\.(\w+)' )
+insertPattern = re.compile( r'\binsert\s+(\w+)' )
+
+
+def findMorphology( cellRoot ):
+    ''' Path of the morphology file of a cell type, or None '''
+    morphDir = os.path.join( cellRoot, "morphology" )
+    if not os.path.isdir( morphDir ):
+        return None
+    for name in sorted( os.listdir( morphDir ) ):
+        if name.lower().endswith( morphologyExtensions ):
+            return os.path.join( morphDir, name )
+    return None
+
+
+def countMorphologyPoints( morphPath ):
+    ''' Number of 3D sample points in a .asc or .swc morphology '''
+    isSwc = morphPath.lower().endswith( '.swc' )
+    count = 0
+    with open( morphPath, 'r', errors='replace' ) as morphFile:
+        for line in morphFile:
+            if isSwc:
+                line = line.strip()
+                if line and not line.startswith( '#' ):
+                    count += 1
+            elif ascPointPattern.match( line ):
+                count += 1
+    return count
+
+
+def countMechanisms( biophysPath ):
+    '''
+    Rough number of mechanisms per compartment from a biophysics.hoc: the
+    mechanisms inserted in every section, plus the average over the other
+    section lists
+    '''
+    regionCounts = {}
+    region = 'all'
+    with open( biophysPath, 'r', errors='replace' ) as biophysFile:
+        for line in biophysFile:
+            match = forsecPattern.search( line )
+            if match:
+                region = match.group( 1 )
+            for _ in insertPattern.finditer( line ):
+                regionCounts[ region ] = regionCounts.get( region, 0 ) + 1
+    everywhere = regionCounts.pop( 'all', 0 )
+    if not regionCounts:
+        return float( everywhere )
+    return everywhere + float( np.mean( list( regionCounts.values() ) ) )
+
+
+def readTemplateName( templatePath ):
+    ''' Name of the template a template.hoc begins, or None '''
+    with open( templatePath, 'r', errors='replace' ) as tmplFile:
+        for line in tmplFile:
+            if( re.search( r"^begintemplate.*", line ) ):
+                line = re.sub( r"(.*begintemplate)|[\r\n]|[ ]", '', line )
+                return line.strip() or None
+    return None
+
+
+def scanDirectory( path ):
+    ''' List a directory: ( its mtime, subdirectories, template files ) '''
+    subDirs = []
+    templates = []
+    with os.scandir( path ) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subDirs.append( entry.path )
+            elif templatePattern.search( entry.name ) and entry.is_file():
+                templates.append( entry.path )
+    return os.stat( path ).st_mtime_ns, sorted( subDirs ), sorted( templates )
+
+
+def describeCell( cellRoot, templatePath ):
+    '''
+    Read what the index keeps about a cell directory. Returns the entry,
+    and the mtimes of the files it was read from.
+    '''
+    morphPath = findMorphology( cellRoot )
+    synapsePath = os.path.join( cellRoot, "synapses/synapses.tsv" )
+    biophysPath = os.path.join( cellRoot, "biophysics.hoc" )
+    entry = { 'templateName' : readTemplateName( templatePath ),
+              'templateFile' : templatePath,
+              'synapseFile' : synapsePath if os.path.isfile( synapsePath ) else None,
+              'morphology' : morphPath,
+              'morphologyPoints' : countMorphologyPoints( morphPath ) if morphPath else 0,
+              'mechanisms' : countMechanisms( biophysPath ) if os.path.isfile( biophysPath ) else 0.0 }
+
+    # Only the files themselves: the cell's directories are written to at
+    # run time (synapse caches, cellname.txt), which mustn't stale the index
+    mtimes = {}
+    for path in ( templatePath, synapsePath, biophysPath, morphPath ):
+        if path is not None and os.path.exists( path ):
+            mtimes[ path ] = os.stat( path ).st_mtime_ns
+    return entry, mtimes
+
+
+def getCacheDir():
+    ''' $XDG_CACHE_HOME/neurpy, by default ~/.cache/neurpy '''
+    cacheHome = os.environ.get( 'XDG_CACHE_HOME', '' ) or os.path.join( os.path.expanduser( '~' ), '.cache' )
+    return os.path.join( cacheHome, 'neurpy' )
+
+
+class ModelIndex( object ):
+    '''
+    The cell types of a model base, by cell directory name: a directory
+    holding a template.hoc is a cell type, and isn't searched further.
+    Each entry has the template name and file, synapse file, morphology
+    file and the size estimates used for load balancing (morphology sample
+    points, mechanisms per compartment). File paths are relative to the
+    model base.
+
+    Indexes are built with directories scanned and cells read in parallel,
+    and cached per model base in `getCacheDir()`. A cached index is used
+    as long as none of the directories searched for cells, or files the
+    entries were read from, have changed mtime, so only a stat per path is
+    needed to start. Cell directories themselves aren't checked, as caches
+    and generated files are written into them.
+    '''
+    def __init__( self, modelRoot, cells=None, mtimes=None ):
+        self.modelRoot = os.path.realpath( modelRoot )
+        self.cells = cells or {}
+        self.mtimes = mtimes or {}
+
+    def __contains__( self, cellType ):
+        return cellType in self.cells
+
+    def __len__( self ):
+        return len( self.cells )
+
+    def getEntry( self, cellType ):
+        return self.cells[ cellType ]
+
+    def getTemplateName( self, cellType ):
+        return self.cells[ cellType ][ 'templateName' ]
+
+    def getPath( self, cellType, field ):
+        ''' Absolute path of a file of a cell type, e.g. 'synapseFile', or None '''
+        path = self.cells[ cellType ][ field ]
+        return os.path.join( self.modelRoot, path ) if path is not None else None
+
+    def build( self, maxWorkers=None ):
+        ''' Index the model base from scratch '''
+        self.cells = {}
+        self.mtimes = {}
+        relPath = lambda path: os.path.relpath( path, self.modelRoot ) if path else path
+        with concurrent.futures.ThreadPoolExecutor( maxWorkers ) as pool:
+            cellJobs = []
+            level = [ self.modelRoot ]
+            while level:
+                nextLevel = []
+                for path, ( mtime, subDirs, templates ) in zip( level, pool.map( scanDirectory, level ) ):
+                    if not templates:
+                        # Cells being added or removed change these
+                        self.mtimes[ relPath( path ) ] = mtime
+                        nextLevel.extend( subDirs )
+                        continue
+                    if len( templates ) != 1:
+                        print( "Warning! More than one template file in %s, using %s"
+                                % ( path, templates[ 0 ] ) )
+                    cellJobs.append( ( path, pool.submit( describeCell, path, templates[ 0 ] ) ) )
+                level = nextLevel
+
+            for cellRoot, job in cellJobs:
+                entry, mtimes = job.result()
+                cellType = os.path.basename( cellRoot )
+                if entry[ 'templateName' ] is None:
+                    print( "Warning! Could not find template name for %s" % entry[ 'templateFile' ] )
+                    continue
+                if cellType in self.cells:
+                    print( "Warning! Cell type %s found in both %s and %s"
+                            % ( cellType, self.cells[ cellType ][ 'path' ], relPath( cellRoot ) ) )
+                for field in ( 'templateFile', 'synapseFile', 'morphology' ):
+                    entry[ field ] = relPath( entry[ field ] )
+                entry[ 'path' ] = relPath( cellRoot )
+                self.cells[ cellType ] = entry
+                for path, mtime in mtimes.items():
+                    self.mtimes[ relPath( path ) ] = mtime
+
+    def isValid( self ):
+        ''' Whether nothing indexed has changed since the index was built '''
+        for path, mtime in self.mtimes.items():
+            try:
+                if os.stat( os.path.join( self.modelRoot, path ) ).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return bool( self.mtimes )
+
+    def getCachePath( self, cacheDir=None ):
+        ''' Cache file of this model base '''
+        key = hashlib.sha1( self.modelRoot.encode( 'utf-8' ) ).hexdigest()[ 0 : 16 ]
+        return os.path.join( cacheDir or getCacheDir(), "modelindex-%s.json" % key )
+
+    def save( self, cacheDir=None ):
+        ''' Write the index to its cache file, replacing any older one in one go '''
+        cachePath = self.getCachePath( cacheDir )
+        tmpPath = "%s.%i.tmp" % ( cachePath, os.getpid() )
+        try:
+            os.makedirs( os.path.dirname( cachePath ), exist_ok=True )
+            with open( tmpPath, 'w' ) as cacheFile:
+                json.dump( { 'version' : indexVersion, 'modelRoot' : self.modelRoot,
+                             'cells' : self.cells, 'mtimes' : self.mtimes }, cacheFile )
+            os.replace( tmpPath, cachePath )
+        except OSError as err:
+            print( "Warning! Could not write model index cache %s: %s" % ( cachePath, err ) )
+            if os.path.exists( tmpPath ):
+                os.remove( tmpPath )
+
+    @staticmethod
+    def load( modelRoot, cacheDir=None ):
+        '''
+        Get the index of a model base, from its cache if still valid,
+        otherwise rebuilt (and cached again)
+        '''
+        index = ModelIndex( modelRoot )
+        cachePath = index.getCachePath( cacheDir )
+        try:
+            with open( cachePath, 'r' ) as cacheFile:
+                cached = json.load( cacheFile )
+            if cached.get( 'version' ) == indexVersion and cached.get( 'modelRoot' ) == index.modelRoot:
+                index.cells = cached[ 'cells' ]
+                index.mtimes = cached[ 'mtimes' ]
+        except ( OSError, ValueError, KeyError ):
+            pass
+        if index.isValid():
+            return index
+
+        print( "Indexing model base %s..." % index.modelRoot )
+        index.build()
+        index.save( cacheDir )
+        return index
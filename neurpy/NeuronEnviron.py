@@ -2,19 +2,50 @@ import neuron
 import os
 from neurpy.pyCell import pyCell
 from neurpy.Neurtwork import Neurtwork
+from neurpy.RandomStreams import RandomStreams
+from neurpy.LoadBalancer import LoadBalancer
+from neurpy.ModelIndex import ModelIndex
+from neurpy.ProgressReporter import PipeReporter
+from neurpy.ProbeOutput import writerTypes, groupByTimebase
 import subprocess
 from subprocess import PIPE
 from importlib import reload
 import numpy as np
 import sys
-import re
-import pickle
+import random
 
 class NeuronEnviron( object ):
-    def __init__(  self, modelRoot, mechanismRoot ):
+    '''
+    Holds the loaded cell types and networks, and runs the simulation.
+
+    With `parallel` set the simulation is distributed over MPI ranks
+    through a ParallelContext (launch with e.g. `mpiexec -n 4 python ...`).
+    Every rank loads the same networks but only builds the cells it owns;
+    the recordings are gathered back to rank 0, which writes the output.
+    Cells are placed on ranks, and with `nthread` > 1 on threads within a
+    rank, by estimated cost (see LoadBalancer); the predicted and achieved
+    load imbalance is printed after each run.
+    '''
+    def __init__(  self, modelRoot, mechanismRoot, seed=None, parallel=False,
+                   nthread=1 ):
         self.modelRoot = modelRoot
+        if parallel:
+            neuron.h.nrnmpi_init()
+            self.pc = neuron.h.ParallelContext()
+            self.rank = int( self.pc.id() )
+            self.nhost = int( self.pc.nhost() )
+        else:
+            self.pc = None
+            self.rank = 0
+            self.nhost = 1
+        self.nthread = nthread
+        # Threads are set up through a ParallelContext even without MPI
+        self.threadContext = self.pc
+        if self.threadContext is None and nthread > 1:
+            self.threadContext = neuron.h.ParallelContext()
         self.loadedCells = {}
-        if not os.path.isdir( "./x86_64" ):
+        self.nextGid = 0
+        if not os.path.isdir( "./x86_64" ) and self.rank == 0:
             subprocess.Popen( [ 'nrnivmodl', mechanismRoot ], stdin=PIPE, 
                                                             stdout=PIPE, 
                                                             stderr=PIPE )
@@ -22,25 +53,40 @@ class NeuronEnviron( object ):
         neuron.h.load_file("import3d.hoc")
         neuron.h.tstop = 1000
         self.symbolTimeStep = 50
+        # Simulated ms run between progress reports
+        self.progressStep = 10
+        # Draw all symbols before the run and let NEURON switch stimuli,
+        # rather than doing it from a callback
+        self.precomputeSymbols = False
+        # If set, probes are written out every outputWindow ms during the
+        # run rather than held in memory until the end
+        self.outputWindow = None
+        # 'binary' (see ProbeOutput.readProbeFile) or 'csv'
+        self.outputFormat = 'binary'
+        # Encoding of probe samples in binary outputs, see TraceCodec:
+        # 'raw', 'float32', or 'int16' / 'delta' to traceResolution
+        self.traceCodec = 'raw'
+        self.traceResolution = 0.01
+        self.verifyTraces = False
         self.networks = []
-
-        # Next make sure we have a cache of the mtype-> template names
-        # for all the cells
-        self.templateCachePath = './.tmpl_cache'
-        self.templateCache = {}
-        if not os.path.exists( self.templateCachePath ):
-            print( "No template cache found, creating..." )
-            self.__recurseFolders( modelRoot )
-            with open( self.templateCachePath, "wb" ) as pklFile:
-                pickle.dump( self.templateCache, pklFile )
-        else:
-            print( "Template cache found, loading..." )
-            with open( self.templateCachePath, "rb" ) as pklFile:
-                self.templateCache = pickle.load( pklFile )
-
-    def createCell( self, cellDirName, synEn=0 ):
-        cellRoot = os.path.join( self.modelRoot, cellDirName )
-        cellRoot = os.path.abspath( cellRoot )
+        # Synapse random streams; runs with the same seed are repeatable
+        if self.pc is not None:
+            # Every rank has to draw from the same streams
+            if seed is None:
+                seed = random.randint( 0, 2**32 - 1 )
+            seed = self.pc.py_broadcast( seed, 0 )
+        self.randomStreams = RandomStreams( seed )
+        self.seed = self.randomStreams.seed
+
+        # Template names, files and sizes of the cell types, from the
+        # shared index of the model base. Rank 0 brings it up to date.
+        self.modelIndex = ModelIndex.load( modelRoot ) if self.rank == 0 else None
+        if self.pc is not None:
+            self.modelIndex = self.pc.py_broadcast( self.modelIndex, 0 )
+        self.loadBalancer = LoadBalancer( modelRoot, self.modelIndex )
+
+    def createCell( self, cellDirName, synEn=0, gid=None ):
+        cellRoot = self.modelIndex.getPath( cellDirName, 'path' )
         cellLoaded = self.loadedCells.get( cellDirName, False )
         curDir = os.getcwd()
         os.chdir( cellRoot )
@@ -48,43 +94,54 @@ class NeuronEnviron( object ):
             print( "Loading cell data from %s" % cellRoot )
             # Load main cell template, which will 
             # load biophysics and morphology
-            templateFile = os.path.join( cellRoot, "template.hoc" )
+            templateFile = self.modelIndex.getPath( cellDirName, 'templateFile' )
             neuron.h.load_file( templateFile )
-        cellTypeName = self.templateCache[ cellDirName ]
-        newCell = pyCell( cellTypeName, synEn, caller="neurpy" )
-        synapseDataPath = os.path.join( cellRoot, "synapses/synapses.tsv" )
-        newCell.loadCellSynapses( synapseDataPath )
+        cellTypeName = self.modelIndex.getTemplateName( cellDirName )
+        if gid is None:
+            gid = self.nextGid
+        self.nextGid = max( self.nextGid, gid + 1 )
+        newCell = pyCell( cellTypeName, synEn, caller="neurpy", gid=gid )
+        synapseDataPath = ( self.modelIndex.getPath( cellDirName, 'synapseFile' ) or
+                            os.path.join( cellRoot, "synapses/synapses.tsv" ) )
+        newCell.loadCellSynapses( synapseDataPath, self.randomStreams )
         os.chdir( curDir )
         return newCell
 
-    def loadTopology( self, filename ):
-        neurtwork = Neurtwork( self, filename )
+    def loadTopology( self, filename, demandDriven=False ):
+        neurtwork = Neurtwork( self, filename, demandDriven )
         self.networks.append( neurtwork )
         return neurtwork
 
     def addNetwork( self, network ):
         self.networks.append( network )
 
-    def runSimulation( self, outputFilepath, pipe ):
+    def runSimulation( self, outputFilepath, pipe, reporter=None ):
+        '''
+        Run all loaded networks for tstop ms and write out the probes and
+        stimulus symbols. Progress goes to `reporter` (a ProgressReporter),
+        or if only `pipe` is given, to a PipeReporter sending the time
+        reached down it.
+        '''
 
-        statEvent = neuron.h.StateTransitionEvent( 1 )
         symbEvent = neuron.h.StateTransitionEvent( 1 )
 
-        tnext = neuron.h.ref( 1 )
         symbTime = neuron.h.ref( 1 )
 
         def fteinit():
-            tnext[ 0 ] = 1.0 # first transition at 1.0
             symbTime[ 0 ] = 0.0 # Update symbols now
 
-            statEvent.state( 0 )   # initial state
-            symbEvent.state( 0 )
-            print( "Starting simulation of length %ims" % neuron.h.tstop )
+            symbEvent.state( 0 )   # initial state
+            self.randomStreams.restart()
+            for network in self.networks:
+                if not self.precomputeSymbols:
+                    network.resetStimuli( neuron.h.tstop, self.symbolTimeStep )
+                for rec in network.recordings:
+                    rec.reset()
+            if self.rank == 0:
+                print( "Starting simulation of length %ims" % neuron.h.tstop )
 
         fih = neuron.h.FInitializeHandler( 1, fteinit )
 
-        timeRecording = neuron.h.Vector()
-        timeRecording.record( neuron.h._ref_t, 0.1 )
         neuron.h.cvode_active( 0 )
 
         plotResult = False
@@ -107,15 +164,7 @@ class NeuronEnviron( object ):
             pylab.gcf().canvas.set_window_title( 'Test' )
 
 
-        def printStat( src ): # current state is the destination. arg gives the source
-            if( src != 0 ):
-                return
-
-            tnext[0] += 1.0 # update for next transition
-            #pipe.value = int( neuron.h.t )
-            pipe.send( int( neuron.h.t ) )
-        
-        def updateSymbols( src ):
+        def updateSymbols( src ): # current state is the destination. arg gives the source
             if( src != 0 ):
                 return
             for network in self.networks:
@@ -123,41 +172,91 @@ class NeuronEnviron( object ):
             symbTime[ 0 ] += self.symbolTimeStep
 
 
-        statEvent.transition( 0, 0, neuron.h._ref_t, tnext, ( printStat, 0 ) )
-        symbEvent.transition( 0, 0, neuron.h._ref_t, symbTime, 
-                              ( updateSymbols, 0 ) )
+        if self.precomputeSymbols:
+            for network in self.networks:
+                network.scheduleStimuli( neuron.h.tstop, self.symbolTimeStep )
+        else:
+            symbEvent.transition( 0, 0, neuron.h._ref_t, symbTime, 
+                                  ( updateSymbols, 0 ) )
+
+        if self.nthread > 1:
+            self.__partitionThreads()
+
+        if reporter is None and pipe is not None:
+            reporter = PipeReporter( pipe )
+        if self.rank != 0:
+            reporter = None
+
+        if self.pc is not None:
+            # Cells only exchange spikes every min. connection delay
+            self.pc.set_maxstep( 10 )
+        neuron.h.stdinit()
+        if reporter is not None:
+            reporter.start( neuron.h.tstop )
+
+        streaming = self.outputWindow is not None
+        writer = None
+        if outputFilepath and self.rank == 0:
+            codec = { 'name' : self.traceCodec }
+            if self.traceCodec in ( 'int16', 'delta' ):
+                codec[ 'resolution' ] = self.traceResolution
+            writer = self.__createWriter( outputFilepath, 'probes', codec=codec )
+        nextFlush = self.outputWindow if streaming else neuron.h.tstop
+
+        # Run in chunks, reporting and emptying the recording buffers in
+        # between, rather than stopping the integration for every report
+        while neuron.h.t < neuron.h.tstop - 0.5 * neuron.h.dt:
+            tnext = min( neuron.h.t + self.progressStep, neuron.h.tstop, nextFlush )
+            if self.pc is None:
+                neuron.h.continuerun( tnext )
+            else:
+                self.pc.psolve( tnext )
+            for network in self.networks:
+                for rec in network.recordings:
+                    rec.drain()
+            if streaming and neuron.h.t >= nextFlush - 0.5 * neuron.h.dt:
+                self.__flushProbes( writer, take=True )
+                nextFlush += self.outputWindow
+            if reporter is not None:
+                reporter.update( neuron.h.t )
+        if reporter is not None:
+            reporter.finish( neuron.h.t )
 
-        neuron.h.run()
-        symbHist  = []
         for network in self.networks:
-            for stim in network.stimuli:
-                symbHist.append( [ stim[ 0 ], stim[ 5 ].activeHistory ] )
-
-        symbTimeVec = [ i * self.symbolTimeStep 
-                            for i in range( len( symbHist[ 0 ][ 1 ] ) ) ]
+            for rec in network.recordings:
+                rec.finish()
+        probeGroups = self.__flushProbes( writer, take=streaming )
+        if writer is not None:
+            writer.close()
+
+        if self.threadContext is not None:
+            self.loadBalancer.report( self.threadContext )
+
+        symbHist = self.__gatherSymbols()
+        if symbHist is None:
+            # Not rank 0; output is written there
+            return None
+
+        # File-driven or skipped stimuli have no symbols, so there may be none
+        numSymbols = len( symbHist[ 0 ][ 1 ] ) if symbHist else 0
+        symbTimeVec = [ i * self.symbolTimeStep for i in range( numSymbols ) ]
         
-        time = np.array( timeRecording )
-        recs = []
-        header = 'time'
-        header2 = 'time'
+        # When streaming, the samples have already gone to disk
+        if streaming or not probeGroups:
+            probeGroups = [ ( ( 0.0, 0.0 ), [], [] ) ]
+        ( t0, dt ), probeTags, recs = probeGroups[ 0 ]
+        recs = list( recs )
+        time = t0 + dt * np.arange( len( recs[ 0 ] ) if recs else 0 )
 
         graphCols = [ 'r-', 'g-', 'b-', 'c-', 'm-' ]
 
-        i = 0
-        for network in self.networks:
-            for rec in network.recordings:
-                recVec = rec[ 1 ].as_numpy()
-                recNp = np.array( recVec )
-                recs.append( recNp )
-                header += ', %s' % rec[ 0 ]
-                if plotResult:
-                    ax.plot( time, recNp, graphCols[ i ], label=rec[ 0 ] )
-                i += 1
+        if plotResult:
+            for i, ( probeTag, recNp ) in enumerate( zip( probeTags, recs ) ):
+                ax.plot( time, recNp, graphCols[ i ], label=probeTag )
 
         symbs = []
         for symb in symbHist:
-            header2 += ', %s' % symb[ 0 ]
-            symbs.append( np.array( symb[ 1 ] ) )
+            symbs.append( np.array( symb[ 1 ], dtype=np.int8 ) )
         
         if plotResult:
             fig.legend()
@@ -171,62 +270,101 @@ class NeuronEnviron( object ):
                     fig3 = pylab.figure()
                     ax3 = fig3.add_subplot( 111 )
                     vs = [ x for x in self.networks[ 0 ].recordings 
-                            if x[ 2 ] == symb[ 0 ] ][ 0 ]
-                    recVec = vs[ 1 ].as_numpy()
-                    recNp = np.array( recVec )
+                            if x.target == symb[ 0 ] ][ 0 ]
+                    recNp = vs.getData()
 
                     ax3.step( symbTimeVec, symb[ 1 ] )
-                    ax3.plot( time, recNp )
+                    ax3.plot( vs.getTimes(), recNp )
             pylab.show()
 
         recs.insert( 0, time )
-        symbs.insert( 0, symbTimeVec )        
         if( outputFilepath ):
-
-            probeData = np.transpose( np.vstack( tuple( recs ) ) )
-            probeFilepath = outputFilepath + "_probes.csv"
-            np.savetxt( probeFilepath, probeData, delimiter=',', 
-                        header=header, comments='' )
-
-            stimFilepath = outputFilepath + "_stim.csv"
-            stimData = np.transpose( np.vstack( tuple( symbs ) ) )
-            np.savetxt( stimFilepath, stimData, delimiter=',',
-                        header=header2, comments='' )
+            stimWriter = self.__createWriter( outputFilepath, 'stim', dtype=np.int8 )
+            # With no symbol stimuli this writes just the header
+            stimGroups = [ ( ( 0.0, float( self.symbolTimeStep ) ),
+                             [ str( symb[ 0 ] ) for symb in symbHist ], symbs ) ]
+            stimWriter.open( stimGroups )
+            stimWriter.append( stimGroups )
+            stimWriter.close()
                          
-        return recs
+        return None if streaming else recs
+
+    def __partitionThreads( self ):
+        ''' Spread this rank's cells over threads by estimated cost '''
+        cells = []
+        costs = []
+        for network in self.networks:
+            for cellId, cell in network.cellDict.items():
+                cells.append( cell )
+                costs.append( network.cellCosts.get( cellId, 1.0 ) )
+        self.loadBalancer.assignThreads( self.threadContext, cells, costs,
+                                         self.nthread )
+
+    def __createWriter( self, outputFilepath, name, dtype=np.float64, codec='raw' ):
+        ''' Writer for the `name` outputs, in the configured output format '''
+        writerType = writerTypes.get( self.outputFormat, None )
+        if writerType is None:
+            raise ValueError( "Unknown output format '%s', expected one of %s"
+                              % ( self.outputFormat, ", ".join( writerTypes ) ) )
+        if self.outputFormat != 'binary':
+            return writerType( outputFilepath, name )
+        metadata = { 'seed' : int( self.seed ), 'tstop' : float( neuron.h.tstop ),
+                     'nhost' : self.nhost, 'symbolTimeStep' : self.symbolTimeStep }
+        return writerType( outputFilepath, name, dtype=dtype, metadata=metadata,
+                           codec=codec, verify=self.verifyTraces )
+
+    def __collectProbes( self, take ):
+        '''
+        Get the drained samples of every recording, in file order across all
+        networks, grouped by timebase (see ProbeOutput.groupByTimebase).
+        With `take` the samples are dropped from the recordings. When running
+        in parallel each rank only holds its own cells' data, so it is
+        gathered onto rank 0; other ranks get None.
+        '''
+        probes = []
+        for netIdx, network in enumerate( self.networks ):
+            for probeIdx, rec in zip( network.probeIndices, network.recordings ):
+                columns = rec.takeColumns() if take else rec.getColumns()
+                probes.append( ( ( netIdx, probeIdx ), rec.timebase, columns ) )
+
+        if self.pc is not None:
+            gathered = self.pc.py_gather( probes, 0 )
+            if self.rank != 0:
+                return None
+            probes = [ probe for rankProbes in gathered for probe in rankProbes ]
+
+        probes.sort( key=lambda probe: probe[ 0 ] )
+        return groupByTimebase( [ probe[ 1 : ] for probe in probes ] )
+
+    def __flushProbes( self, writer, take ):
+        ''' Collect the recordings' samples and append them to the output '''
+        groups = self.__collectProbes( take )
+        if groups is not None and writer is not None:
+            if not writer.isOpen:
+                writer.open( groups or [ ( ( 0.0, 0.0 ), [], [] ) ] )
+            writer.append( groups )
+        return groups
+
+    def __gatherSymbols( self ):
+        '''
+        Collect [ stim target, symbol history ] for every stimulus, in file
+        order across all networks, gathered onto rank 0 like the probes
+        '''
+        symbHist = []
+        for netIdx, network in enumerate( self.networks ):
+            for stimIdx, stim in zip( network.stimulusIndices, network.stimuli ):
+                symbHist.append( ( ( netIdx, stimIdx ), stim[ 0 ],
+                                   list( stim[ 5 ].activeHistory ) ) )
+
+        if self.pc is not None:
+            gathered = self.pc.py_gather( symbHist, 0 )
+            if self.rank != 0:
+                return None
+            symbHist = [ symb for rankSymbs in gathered for symb in rankSymbs ]
+
+        symbHist.sort( key=lambda symb: symb[ 0 ] )
+        return [ [ target, hist ] for _, target, hist in symbHist ]
 
     def generateGUI( self, recSec, stimCell, synapses=False ):
         from neurpy.NeurGUI import NeurGUI
         return NeurGUI( recSec, stimCell, synapses )
-
-
-    def __cacheCellName( self, templatePath ):
-        root, templateName = os.path.split( templatePath )
-        cellMTypeName = os.path.basename( root )
-        templateStr = None
-        with open( templatePath, 'r' ) as tmplFile:
-            for line in tmplFile:
-                if( re.search( r"^begintemplate.*", line ) ):
-                    line = re.sub( r"(.*begintemplate)|[\r\n]|[ ]", '', line )
-                    templateStr = line.strip()
-                    break
-        if not templateStr:
-            print( "Warning! Could not find template name for %s" % templatePath )
-            return
-        
-        self.templateCache[ cellMTypeName ] = templateStr
-
-
-    def __recurseFolders( self, rootDir ):
-        # Check for the cell template file
-        dirListing = [ sub for sub in os.listdir( rootDir ) ]
-        templateFiles = [ os.path.join( rootDir, tmpl ) for tmpl in dirListing if re.search( r'template\.hoc', tmpl ) and os.path.isfile( os.path.join( rootDir, tmpl ) ) ]
-        if templateFiles:
-            if len( templateFiles ) != 1:
-                print( "More than 1 template file? Wat" )
-            self.__cacheCellName( templateFiles[ 0 ] )    
-            
-        else:
-            dirs = [ os.path.join( rootDir, dir ) for dir in dirListing if os.path.isdir( os.path.join( rootDir, dir ) ) ]
-            for dir in dirs:
-                self.__recurseFolders( dir )
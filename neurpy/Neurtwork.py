@@ -1,10 +1,17 @@
 
 from neurpy.CellStim import CellStim
+from neurpy.pyCell import pyCell
 import networkx as nx
-from xml.dom import minidom
-import neuron
+from neurpy.BinaryTopology import BinaryTopology, isBinaryTopology
+from neurpy.TopologyLoader import iterTopology, getAttribute
+from neurpy.Recording import Recording, resolveLocation
+from neurpy.Connectivity import Connectivity
+from neurpy.StimulusEngine import StimulusEngine
+from neurpy.FileStimulus import FileStimulus
+from neurpy.SynapseSelection import selectSynapses
+import numpy as np
+import os
 import random
-import collections
 
 class Neurtwork( object ):
     ''' 
@@ -12,136 +19,108 @@ class Neurtwork( object ):
     File is of modified GEXF format, modifications allowing for probes, stimuli
     and other attribute classifications.
     
-    The `recordings` member contains the neuron.h.Vector objects which
-    correspond to the soma probe attached to a given cell, as specified by a
-    `probe` object in the loaded file. Also has a "probe tag" to help identify
-    what cell is being recorded; the tag can be specified within the file or
-    can be automatically generated by `cell name`_`probe ID`.
+    The `recordings` member contains the Recording objects which correspond
+    to the probes attached to a given cell, as specified by a `probe` object
+    in the loaded file. Each has a "probe tag" to help identify what cell is
+    being recorded; the tag can be specified within the file or can be
+    automatically generated by `cell name`_`probe ID`. Probes record soma
+    voltage every 0.1ms by default; the `var`, `loc` (e.g. "dend[3](0.2)"),
+    `interval`, `decimation` ('stride' or 'minmax') and `factor` attributes
+    change what is recorded.
+
+    When the environment runs with a ParallelContext, each rank only builds
+    the cells it owns, so `cellDict` and the recordings/stimuli lists only
+    hold this rank's share. Cells are given gids in file order either way,
+    and `probeIndices`/`stimulusIndices` give the position of each local
+    recording/stimulus in the file. When spreading cells over ranks or
+    threads, the topology is read once beforehand to estimate each cell's
+    cost (`cellCosts`); across ranks, the environment's LoadBalancer then
+    decides which rank owns each cell (`gidOwners`).
+
+    `edges` is the network's Connectivity, holding every edge (on every
+    rank) and the NetCons made for them.
+
+    With `demandDriven` set, only cells that matter to a probe are built:
+    those on a path from a stimulated cell to a probed cell, and the probed
+    cells themselves. The rest are listed in `skippedCells`, and edges and
+    stimuli that involve them aren't made.
+
+    Stimuli with a `stimFile` play spike times or a current waveform from a
+    memory-mapped .npy file instead of symbols; they are kept in
+    `fileStimuli` rather than `stimuli`.
     '''
-    def __init__( self, env, filepath=None ):
+    def __init__( self, env, filepath=None, demandDriven=False ):
         self.cells = []
         self.cellDict = {}
+        self.cellGids = {}
+        self.pc = None
+        self.rank = 0
+        self.nhost = 1
+        self.gidBase = 0
+        self.seed = 0
+        self.gidOwners = None
+        self.cellCosts = {}
+        self.neededCells = None
+        self.skippedCells = []
+        self.numProbes = 0
+        self.numStimuli = 0
+        self.probeIndices = []
+        self.stimulusIndices = []
         self.headCell = []
         self.nxGraph = None
         self.recordings = []
         self.stimuli = []
-        self.edges = collections.defaultdict( dict )
+        self.fileStimuli = []
+        self.topologyDir = ''
+        self.edges = Connectivity()
+        self.stimulusEngine = None
         if( filepath ):
-            self.loadTopology( filepath, env )
-        
-    def loadTopology( self, filePath, env ):
-        ''' Load graph from pseudo-GEXF file '''
-        domFile = minidom.parse( filePath )
-
-        # Helper function; return default if attrib not found
-        def getAttribDefault( element, name, default ):
-            val = element.getAttribute( name )
-            if not val:
-                val = default
-            return val            
-
-        # Locate the elements required
-        cells = domFile.getElementsByTagName( 'cell' )
-        edges = domFile.getElementsByTagName( 'edge' )
-        stimuli = domFile.getElementsByTagName( 'stim' )
-        probes = domFile.getElementsByTagName( 'probe' )
-
-        # Load in each cell
-        for cell in cells:
-            id = cell.getAttribute( "id" )
-            cellType = cell.getAttribute( "cellType" )
-            enSyn = 0#cell.getAttribute( "label" ) == "Head"
-            self.cellDict[ id ] = env.createCell( cellType, enSyn )
-          #  self.cellDict[ id ].tempStim()
-            if( cell.getAttribute( "label" ) == "Head" ):
-                print( "Enabling all stimuli for cell %s" % id )
-                self.cellDict[ id ].tempStim()
-        i = 0
-        for edge in edges:
-            source = edge.getAttribute( "source" )
-            target = edge.getAttribute( "target" )
-            synType = edge.getAttribute( "connType" )
-            conCount = edge.getAttribute( "connCount" )
-            weight = getAttribDefault( edge, "weight", None )
-            delay = getAttribDefault( edge, "delay", None )
-            threshold = getAttribDefault( edge, "threshold", None )
-            # Can't add a connection if theres no weight/delay
-            if( not weight or not delay ):
-                "Error: No weight/delay specification for edge!"
-                continue
-            synType = int( synType )
-            conCount = int( conCount )
-            weight = float( weight )
-            delay = float( delay )
-            if threshold:
-                threshold = float( threshold )
-            
-            self.cellDict[ source ].addChild( self.cellDict[ target ], 
-                                              synType, conCount, weight, 
-                                              delay, threshold )
-            edge = Edge( delay, weight, synType, conCount )
-            self.edges[ source ][ target ] = edge
-            i += 1
+            self.loadTopology( filepath, env, demandDriven )
         
-        for stim in stimuli:
-            # For now this is just the same as in the sample code.
-            # May change later to something else
-
-            target = stim.getAttribute( 'target' )
-            stimFile = stim.getAttribute( 'stimFile' )
-            delay = float( stim.getAttribute( 'delay' ) )
-            dur = float( stim.getAttribute( 'dur' ) )
-            prob = 0.5
-            stimEn = False
-
-            cell = self.cellDict[ target ]
-            cellStim = CellStim()
-            cellStim.createStim()
-
-            for syn in cell.synapses.excSyn:
-                if not syn.initialised:
-                    syn.initialise()
-                cellStim.connectToSynapse( syn.synapse )
-
-            self.stimuli.append( [ target, delay, dur, prob, [], cellStim ] )
-
-
-            # if not stimFile:
-
-            #     stimFile = './current_amps.dat'
-            
-            # step_amp = [0] * 3
-            # with open( 'current_amps.dat', 'r' ) as current_amps_file:
-            #     first_line = current_amps_file.read().split( '\n' )[ 0 ].strip()
-            #     hyp_amp, step_amp[ 0 ], step_amp[ 1 ], step_amp[ 2 ] = first_line.split( ' ' )
-
-            # iclamp = neuron.h.IClamp( 0.5, sec=cell.soma[ 0 ] )
-            # iclamp.delay = 700
-            # iclamp.dur = 2000
-            # iclamp.amp = float( step_amp[ 0 ] )
-
-            # self.stimuli.append( iclamp )
-
-            # hyp_iclamp = neuron.h.IClamp( 0.5, sec=cell.soma[ 0 ] )
-            # hyp_iclamp.delay = 0
-            # hyp_iclamp.dur = 3000
-            # hyp_iclamp.amp = float( hyp_amp )
-
-            # self.stimuli.append( hyp_iclamp )
-            
-
-
-        for probe in probes:
-            target = probe.getAttribute( "target" )
-            probeTag = probe.getAttribute( "tag" )
-            probeID = probe.getAttribute( "id" )
-            targetCell = self.cellDict[ target ]
-            if not probeTag:
-                probeTag = "%s_%s" %( targetCell.cellName, probeID )
-            
-            newRecording = neuron.h.Vector()
-            newRecording.record( targetCell.neurCell.soma[ 0 ]( 0.5 )._ref_v, 0.1 )
-            self.recordings.append( ( probeTag, newRecording, target ) )
+    def loadTopology( self, filePath, env, demandDriven=False ):
+        '''
+        Load graph from pseudo-GEXF file, streaming it element by element,
+        or from its binary form (see BinaryTopology)
+        '''
+        self.pc = env.pc
+        self.rank = env.rank
+        self.nhost = env.nhost
+        self.gidBase = env.nextGid
+        self.seed = env.seed
+        self.topologyDir = os.path.dirname( os.path.abspath( filePath ) )
+        # Each network draws its own symbols
+        self.stimulusEngine = StimulusEngine( env.seed, self.gidBase )
+
+        if isBinaryTopology( filePath ):
+            iterElements = BinaryTopology.load( filePath ).iterElements
+        else:
+            iterElements = lambda: iterTopology( filePath )
+
+        self.neededCells = None
+        if demandDriven:
+            self.neededCells = self.__findNeededCells( iterElements() )
+        if self.nhost > 1 or env.nthread > 1:
+            self.__planPlacement( iterElements(), env )
+
+        for tag, attrib in iterElements():
+            if tag == 'cell':
+                self.__loadCell( attrib, env )
+            elif tag == 'edge':
+                self.__loadEdge( attrib )
+            elif tag == 'stim':
+                self.__loadStim( attrib )
+            elif tag == 'probe':
+                self.__loadProbe( attrib )
+
+        self.stimulusEngine.totalStimuli = self.numStimuli
+
+        # Keep gids unique across networks, whichever cells this rank built
+        env.nextGid = max( env.nextGid, self.gidBase + len( self.cellGids ) )
+
+        if self.neededCells is not None and self.rank == 0:
+            print( "Demand-driven load: %i of %i cells needed, skipped %i: %s"
+                    % ( len( self.neededCells ), len( self.cellGids ),
+                        len( self.skippedCells ), ", ".join( self.skippedCells ) ) )
 
         '''
         # Test: measure the voltage at some dendrites on the second cell.
@@ -158,13 +137,242 @@ class Neurtwork( object ):
         # plt.subplot( 122 )
         # nx.draw( self.nxGraph )
 
+    def __findNeededCells( self, elements ):
+        '''
+        IDs of the cells that can carry activity from a stimulus to a probe:
+        descendants of stimulated cells that are also ancestors of probed
+        cells, plus the probed cells
+        '''
+        graph = Connectivity()
+        stimTargets = []
+        probeTargets = []
+        for tag, attrib in elements:
+            if tag == 'cell':
+                graph.addCell( attrib[ "id" ] )
+            elif tag == 'edge':
+                # Edges missing a weight/delay aren't connected
+                if getAttribute( attrib, "weight", float ) is not None and \
+                   getAttribute( attrib, "delay", float ) is not None:
+                    graph.addEdge( attrib[ "source" ], attrib[ "target" ], 0.0, 0.0, 0, 0 )
+            elif tag == 'stim':
+                stimTargets.append( attrib[ "target" ] )
+            elif tag == 'probe':
+                probeTargets.append( attrib[ "target" ] )
+
+        driven = set( graph.reachable( stimTargets ) )
+        observed = set( graph.reachable( probeTargets, reverse=True ) )
+        return ( driven & observed ) | set( probeTargets )
+
+    def __planPlacement( self, elements, env ):
+        ''' Estimate cell costs and, across ranks, decide who owns each cell '''
+        cellIds, costs = env.loadBalancer.estimateTopology( elements )
+        if self.neededCells is not None:
+            # Skipped cells cost nothing
+            costs[ [ cellId not in self.neededCells for cellId in cellIds ] ] = 0.0
+        self.cellCosts = dict( zip( cellIds, costs.tolist() ) )
+        if self.nhost > 1:
+            ranks = env.loadBalancer.assignRanks( costs, self.nhost )
+            self.gidOwners = { self.gidBase + idx : int( rank )
+                                for idx, rank in enumerate( ranks ) }
+
+    def ownerOf( self, gid ):
+        ''' Rank that builds the cell with the given gid '''
+        if self.gidOwners is None:
+            # Placement is only planned across several ranks; a single rank
+            # owns everything
+            return 0
+        return self.gidOwners[ gid ]
+
+    def __loadCell( self, cell, env ):
+        id = cell[ "id" ]
+        cellType = cell[ "cellType" ]
+        enSyn = 0#cell.get( "label" ) == "Head"
+        gid = self.gidBase + len( self.cellGids )
+        self.cellGids[ id ] = gid
+        self.edges.addCell( id )
+        if self.neededCells is not None and id not in self.neededCells:
+            self.skippedCells.append( id )
+            return
+        if self.pc is not None and self.ownerOf( gid ) != self.rank:
+            return
+
+        self.cellDict[ id ] = env.createCell( cellType, enSyn, gid=gid )
+        if self.pc is not None:
+            # Register the cell as a spike source for the other ranks
+            self.pc.set_gid2node( gid, self.rank )
+            self.pc.cell( gid, self.cellDict[ id ].createSpikeDetector() )
+      #  self.cellDict[ id ].tempStim()
+        if( cell.get( "label", '' ) == "Head" ):
+            print( "Enabling all stimuli for cell %s" % id )
+            self.cellDict[ id ].tempStim()
+
+    def __loadEdge( self, edge ):
+        source = edge[ "source" ]
+        target = edge[ "target" ]
+        weight = getAttribute( edge, "weight", float )
+        delay = getAttribute( edge, "delay", float )
+        threshold = getAttribute( edge, "threshold", float )
+        # Can't add a connection if theres no weight/delay
+        if( weight is None or delay is None ):
+            print( "Error: No weight/delay specification for edge %s -> %s!"
+                    % ( source, target ) )
+            return
+        synType = int( edge.get( "connType", '' ) )
+        conCount = int( edge.get( "connCount", '' ) )
+        
+        netCons = []
+        if self.neededCells is not None and ( source not in self.neededCells or
+                                              target not in self.neededCells ):
+            # One end wasn't built
+            pass
+        elif self.pc is None:
+            netCons = self.cellDict[ source ].addChild( self.cellDict[ target ], 
+                                                        synType, conCount, weight, 
+                                                        delay, threshold )
+        else:
+            # The target's rank makes the connection; the source's rank
+            # owns the spike threshold
+            if target in self.cellDict:
+                netCons = self.cellDict[ target ].addParentGid( self.cellGids[ source ],
+                                                                self.pc, synType, conCount,
+                                                                weight, delay )
+            if threshold is not None and source in self.cellDict:
+                self.cellDict[ source ].spikeDetector.threshold = threshold
+        self.edges.addEdge( source, target, delay, weight, synType, conCount,
+                            netCons )
+
+    def __loadStim( self, stim ):
+        # For now this is just the same as in the sample code.
+        # May change later to something else
+
+        target = stim[ 'target' ]
+        stimFile = getAttribute( stim, 'stimFile', str, '' )
+        delay = float( stim[ 'delay' ] )
+        dur = float( stim[ 'dur' ] )
+        prob = 0.5
+        stimEn = False
+
+        stimIndex = self.numStimuli
+        self.numStimuli += 1
+        if target not in self.cellDict:
+            return
+
+        cell = self.cellDict[ target ]
+        if stimFile:
+            self.__loadFileStim( stim, cell, stimFile, delay, dur, stimIndex )
+            return
+
+        cellStim = CellStim()
+        cellStim.createStim()
+
+        for syn in self.__selectStimSynapses( stim, cell, stimIndex ):
+            cellStim.connectToSynapse( syn.synapse )
+
+        self.stimulusEngine.addStimulus( cellStim, stimIndex )
+        self.stimuli.append( [ target, delay, dur, prob, [], cellStim ] )
+        self.stimulusIndices.append( stimIndex )
+
+    def __selectStimSynapses( self, stim, cell, stimIndex ):
+        '''
+        Pick and initialise the excitatory synapses a stimulus drives. All of
+        them unless the stim has a `fanIn`, in which case that many are
+        picked by its `selection` strategy: 'random' (the default),
+        'sectionList' (from the comma separated `sectionLists` IDs) or
+        'distance' (closest to the point `x`,`y`,`z`, by default the cell's
+        position, within an optional `radius` µm). Random picks are seeded
+        by the stim's `seed`, or else from the network seed and the stim's
+        index, so they are repeatable.
+        '''
+        synapses = cell.synapses
+        fanIn = getAttribute( stim, 'fanIn', int )
+        selection = getAttribute( stim, 'selection', str )
+        if fanIn is None and selection is None:
+            indices = synapses.excIndices
+        else:
+            count = fanIn if fanIn is not None else len( synapses.excIndices )
+            selection = selection or 'random'
+            strategyArgs = {}
+            if selection == 'random':
+                strategyArgs[ 'seed' ] = getAttribute( stim, 'seed', int,
+                                                       [ self.seed, self.gidBase, stimIndex ] )
+            elif selection == 'sectionList':
+                sectionLists = getAttribute( stim, 'sectionLists', str, '1' )
+                strategyArgs[ 'sectionlistIds' ] = tuple(
+                    int( listId ) for listId in sectionLists.split( ',' ) )
+            elif selection == 'distance':
+                strategyArgs[ 'centre' ] = [ getAttribute( stim, axis, float, cell.position[ i ] )
+                                             for i, axis in enumerate( ( 'x', 'y', 'z' ) ) ]
+                strategyArgs[ 'radius' ] = getAttribute( stim, 'radius', float, np.inf )
+            indices = selectSynapses( selection, None, cell, 0, count, **strategyArgs )
+        return [ syn for syn in synapses.initialiseMany( indices ) if syn.initialised ]
+
+    def __loadFileStim( self, stim, cell, stimFile, delay, dur, stimIndex ):
+        '''
+        Stimulus played back from a .npy library (see FileStimulus). The
+        `stimType` attribute is 'spikes' (default), delivered with the given
+        `weight` to excitatory synapses picked as for other stimuli, or 'current', injected
+        at the soma with samples every `dt` ms. `stimIndex` picks a row of
+        2D libraries. Relative paths are looked up next to the topology file
+        first.
+        '''
+        stimPath = stimFile
+        if not os.path.isabs( stimPath ) and \
+           os.path.exists( os.path.join( self.topologyDir, stimPath ) ):
+            stimPath = os.path.join( self.topologyDir, stimPath )
+        kind = getAttribute( stim, 'stimType', str, 'spikes' )
+        fileStim = FileStimulus( stim[ 'target' ], stimPath, kind,
+                                 index=getAttribute( stim, 'stimIndex', int, 0 ),
+                                 delay=delay, dur=dur,
+                                 dt=getAttribute( stim, 'dt', float, 0.1 ) )
+        if kind == 'spikes':
+            weight = getAttribute( stim, 'weight', float, 1.0 )
+            for syn in self.__selectStimSynapses( stim, cell, stimIndex ):
+                fileStim.connectToSynapse( syn.synapse, weight )
+        else:
+            fileStim.injectAt( cell.neurCell.soma[ 0 ]( 0.5 ) )
+        self.fileStimuli.append( fileStim )
+
+    def __loadProbe( self, probe ):
+        target = probe[ "target" ]
+        probeTag = getAttribute( probe, "tag", str, '' )
+        probeID = getAttribute( probe, "id", str, '' )
+        probeIndex = self.numProbes
+        self.numProbes += 1
+        if target not in self.cellDict:
+            return
+
+        targetCell = self.cellDict[ target ]
+        if not probeTag:
+            probeTag = "%s_%s" %( targetCell.cellName, probeID )
+        
+        # Soma voltage every 0.1ms unless the probe says otherwise
+        segment = resolveLocation( targetCell.neurCell,
+                                   getAttribute( probe, "loc", str, "soma[0](0.5)" ) )
+        newRecording = Recording( probeTag, target, segment,
+                                  var=getAttribute( probe, "var", str, 'v' ),
+                                  interval=getAttribute( probe, "interval", float, 0.1 ),
+                                  decimation=getAttribute( probe, "decimation", str, 'none' ),
+                                  factor=getAttribute( probe, "factor", int, 1 ) )
+        self.recordings.append( newRecording )
+        self.probeIndices.append( probeIndex )
+
+    def transformCells( self, transforms ):
+        '''
+        Place many cells in one batch. `transforms` maps a cell ID to a
+        ( rotation, translation ) pair, as taken by `pyCell.transform`.
+        '''
+        cellIds = list( transforms.keys() )
+        pyCell.transformMany( [ self.cellDict[ cellId ] for cellId in cellIds ],
+                              [ transforms[ cellId ][ 0 ] for cellId in cellIds ],
+                              [ transforms[ cellId ][ 1 ] for cellId in cellIds ] )
+
+    def resetStimuli( self, tstop, symbolTimeStep ):
+        ''' Restart the symbol sequences, before a run '''
+        self.stimulusEngine.reset( tstop, symbolTimeStep )
+
+    def scheduleStimuli( self, tstop, symbolTimeStep ):
+        ''' Draw a whole run's symbols, to be played back by NEURON '''
+        self.stimulusEngine.schedule( tstop, symbolTimeStep )
+
     def updateStimuli( self ):
-        for stim in self.stimuli:
-            stim[ 5 ].updateStimulus()
-
-class Edge:
-    def __init__( self, delay, weight, synType, connCount ):
-        self.delay = delay
-        self.weight = weight
-        self.synType = synType
-        self.connCount = connCount
+        self.stimulusEngine.update()
@@ -0,0 +1,207 @@
+'''
+Writers for probe recordings, fed a window of samples at a time, and a
+reader for their binary output.
+'''
+import json
+import struct
+import numpy as np
+from neurpy.TraceCodec import createCodec
+
+# Binary column files: magic, header length, JSON header, then blocks
+binaryMagic = b'NCOL'
+binaryVersion = 2
+binaryExtension = '.ncol'
+headerFormat = struct.Struct( '<4sI' )
+blockFormat = struct.Struct( '<Q' )
+columnFormat = struct.Struct( '<Q' )
+
+
+def getOutputPath( basePath, name, groupIdx, extension ):
+    '''
+    Columns on the first timebase go in <base>_<name>, those on any other
+    timebase get a file each
+    '''
+    if groupIdx == 0:
+        return "%s_%s%s" % ( basePath, name, extension )
+    return "%s_%s_%i%s" % ( basePath, name, groupIdx, extension )
+
+
+def groupByTimebase( probes ):
+    '''
+    Gather ( timebase, [ ( column name, samples ) ] ) probes into groups
+    with the same timebase, in order of first appearance. Returns a list of
+    ( ( t0, dt ), column names, sample arrays ).
+    '''
+    groups = {}
+    ordered = []
+    for timebase, columns in probes:
+        group = groups.get( timebase, None )
+        if group is None:
+            group = ( tuple( timebase[ 0 : 2 ] ), [], [] )
+            groups[ timebase ] = group
+            ordered.append( group )
+        for name, samples in columns:
+            group[ 1 ].append( name )
+            group[ 2 ].append( samples )
+    return ordered
+
+
+class ProbeWriter( object ):
+    '''
+    Base class for writers of column groups, one file per group, appended
+    to as samples arrive. Files are written append-only, so memory use
+    depends on the size of each window, not the run length. Subclasses
+    write the header and the blocks of samples.
+    '''
+    extension = ''
+    fileMode = 'w'
+
+    def __init__( self, basePath, name='probes' ):
+        self.basePath = basePath
+        self.name = name
+        self.files = []
+        self.timebases = []
+        self.written = []
+        self.isOpen = False
+
+    def open( self, groups ):
+        ''' Create the files and write their headers '''
+        for groupIdx, ( timebase, names, _ ) in enumerate( groups ):
+            path = getOutputPath( self.basePath, self.name, groupIdx, self.extension )
+            outFile = open( path, self.fileMode )
+            self.writeHeader( outFile, timebase, names )
+            self.files.append( outFile )
+            self.timebases.append( timebase )
+            self.written.append( 0 )
+        self.isOpen = True
+
+    def append( self, groups ):
+        ''' Write the next samples of each group, in the order given to `open` '''
+        for groupIdx, ( _, _, arrays ) in enumerate( groups ):
+            numSamples = len( arrays[ 0 ] ) if arrays else 0
+            self.writeBlock( self.files[ groupIdx ], self.timebases[ groupIdx ],
+                             self.written[ groupIdx ], numSamples, arrays )
+            self.written[ groupIdx ] += numSamples
+
+    def close( self ):
+        for outFile in self.files:
+            outFile.close()
+        self.files = []
+        self.isOpen = False
+
+    def writeHeader( self, outFile, timebase, names ):
+        pass
+
+    def writeBlock( self, outFile, timebase, start, numSamples, arrays ):
+        pass
+
+
+class CsvProbeWriter( ProbeWriter ):
+    ''' Text output, led by a time column, as "time, <names>" CSV '''
+    extension = '.csv'
+
+    def writeHeader( self, outFile, timebase, names ):
+        outFile.write( 'time' + ''.join( ', %s' % name for name in names ) + '\n' )
+
+    def writeBlock( self, outFile, timebase, start, numSamples, arrays ):
+        t0, dt = timebase
+        time = t0 + dt * np.arange( start, start + numSamples )
+        np.savetxt( outFile, np.column_stack( [ time ] + list( arrays ) ), delimiter=',' )
+
+
+class BinaryProbeWriter( ProbeWriter ):
+    '''
+    Binary columnar output. A file starts with "NCOL", the header length
+    and a JSON header holding the column names, timebase, sample type,
+    codec and any `metadata`; then each appended window is a block of its
+    sample count followed by each column's encoded length and samples.
+    With the 'raw' codec, columns already in the sample type are written
+    straight from their buffers. Time isn't stored: sample i is at
+    t0 + i * dt.
+
+    `codec` is a TraceCodec name or spec, e.g. { 'name' : 'int16',
+    'resolution' : 0.01 }. With `verify`, every column written is decoded
+    again and checked against the codec's error bound.
+    '''
+    extension = binaryExtension
+    fileMode = 'wb'
+
+    def __init__( self, basePath, name='probes', dtype=np.float64, metadata=None,
+                  codec='raw', verify=False ):
+        super().__init__( basePath, name )
+        self.dtype = np.dtype( dtype ).newbyteorder( '<' )
+        self.metadata = metadata or {}
+        self.codec = createCodec( codec, self.dtype )
+        self.verify = verify
+
+    def writeHeader( self, outFile, timebase, names ):
+        header = json.dumps( { 'version' : binaryVersion,
+                               't0' : timebase[ 0 ],
+                               'dt' : timebase[ 1 ],
+                               'dtype' : self.dtype.str,
+                               'codec' : self.codec.getSpec(),
+                               'columns' : list( names ),
+                               'metadata' : self.metadata } ).encode( 'utf-8' )
+        outFile.write( headerFormat.pack( binaryMagic, len( header ) ) )
+        outFile.write( header )
+
+    def writeBlock( self, outFile, timebase, start, numSamples, arrays ):
+        if numSamples == 0:
+            return
+        outFile.write( blockFormat.pack( numSamples ) )
+        for samples in arrays:
+            data = self.codec.encode( samples )
+            if self.verify:
+                self.codec.verify( samples, data )
+            outFile.write( columnFormat.pack( memoryview( data ).nbytes ) )
+            outFile.write( data )
+
+
+# Writers by NeuronEnviron.outputFormat
+writerTypes = { 'binary' : BinaryProbeWriter, 'csv' : CsvProbeWriter }
+
+
+def readProbeFile( path ):
+    '''
+    Read a binary column file. Returns ( header, columns ), where columns
+    maps 'time' and then each column name, in file order, to its samples.
+    '''
+    with open( path, 'rb' ) as inFile:
+        magic, headerLength = headerFormat.unpack( inFile.read( headerFormat.size ) )
+        if magic != binaryMagic:
+            raise ValueError( "%s: Not a binary probe file" % path )
+        header = json.loads( inFile.read( headerLength ).decode( 'utf-8' ) )
+        dtype = np.dtype( header[ 'dtype' ] )
+        codec = createCodec( header.get( 'codec', 'raw' ), dtype )
+        names = header[ 'columns' ]
+        chunks = [ [] for _ in names ]
+        while True:
+            block = inFile.read( blockFormat.size )
+            if len( block ) < blockFormat.size:
+                break
+            numSamples, = blockFormat.unpack( block )
+            for chunk in chunks:
+                if header[ 'version' ] < 2:
+                    # Raw samples, without lengths
+                    numBytes = numSamples * dtype.itemsize
+                else:
+                    numBytes, = columnFormat.unpack( inFile.read( columnFormat.size ) )
+                chunk.append( codec.decode( inFile.read( numBytes ), numSamples ) )
+
+    columns = {}
+    numSamples = sum( len( chunk ) for chunk in chunks[ 0 ] ) if chunks else 0
+    columns[ 'time' ] = header[ 't0' ] + header[ 'dt' ] * np.arange( numSamples )
+    for name, chunk in zip( names, chunks ):
+        columns[ name ] = np.concatenate( chunk ) if chunk else np.empty( 0, dtype )
+    return header, columns
+
+
+def exportCsv( path, csvPath=None ):
+    ''' Convert a binary column file to CSV, next to it by default '''
+    if csvPath is None:
+        csvPath = path[ : -len( binaryExtension ) ] if path.endswith( binaryExtension ) else path
+        csvPath += '.csv'
+    header, columns = readProbeFile( path )
+    np.savetxt( csvPath, np.column_stack( list( columns.values() ) ), delimiter=',',
+                header=', '.join( columns.keys() ), comments='' )
+    return csvPath
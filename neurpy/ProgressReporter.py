@@ -0,0 +1,50 @@
+'''
+Reporting of simulation progress, throttled to a wall-clock rate.
+'''
+import time
+
+
+class ProgressReporter( object ):
+    '''
+    Base class for progress reporters. The simulation calls `start` before
+    running, `update` after each chunk it runs and `finish` at the end;
+    `update` only passes progress on to `report` at most `rate` times per
+    second of wall-clock time, however often it is called. Subclasses
+    override `report`.
+    '''
+    def __init__( self, rate=2.0 ):
+        self.minInterval = 1.0 / rate if rate > 0 else 0.0
+        self.lastReport = None
+        self.tstop = 0.0
+
+    def start( self, tstop ):
+        self.tstop = tstop
+        self.lastReport = None
+
+    def update( self, t ):
+        now = time.monotonic()
+        if self.lastReport is None or now - self.lastReport >= self.minInterval:
+            self.lastReport = now
+            self.report( t )
+
+    def finish( self, t ):
+        self.report( t )
+
+    def report( self, t ):
+        pass
+
+
+class PrintReporter( ProgressReporter ):
+    ''' Prints the simulated time reached '''
+    def report( self, t ):
+        print( "Simulated %.1f / %.1f ms" % ( t, self.tstop ) )
+
+
+class PipeReporter( ProgressReporter ):
+    ''' Sends the simulated time reached, in whole ms, down a multiprocessing pipe '''
+    def __init__( self, pipe, rate=2.0 ):
+        super().__init__( rate )
+        self.pipe = pipe
+
+    def report( self, t ):
+        self.pipe.send( int( t ) )
@@ -0,0 +1,105 @@
+'''
+Deterministic random streams for stochastic synapses.
+'''
+import neuron
+import numpy as np
+import random
+
+# Constants of the splitmix64 finaliser
+mixMultA = np.uint64( 0xbf58476d1ce4e5b9 )
+mixMultB = np.uint64( 0x94d049bb133111eb )
+
+
+def mix64( values ):
+    ''' splitmix64 finaliser, applied element-wise to a uint64 array '''
+    values = ( values ^ ( values >> np.uint64( 30 ) ) ) * mixMultA
+    values = ( values ^ ( values >> np.uint64( 27 ) ) ) * mixMultB
+    return values ^ ( values >> np.uint64( 31 ) )
+
+
+class RandomStreams( object ):
+    '''
+    Hands out random streams keyed by ( network seed, cell gid, synapse id ),
+    so that a simulation with a given seed draws the same numbers whatever
+    process it runs in and whatever order synapses are created in.
+
+    Synapse release uses NEURON's counter-based Random123 generator. The
+    synapse mechanisms hold on to the Random object passed to `setRNG`, so
+    one is kept per instantiated synapse, but they are owned here rather
+    than by each synapse and can be dropped per cell with `releaseCell`.
+    One-off parameter draws (e.g. GABA rise times) are computed in NumPy
+    from a hash of the key and need no hoc objects at all.
+
+    If no seed is given one is picked at random; it is kept in `seed` so
+    the run can be repeated.
+    '''
+    defaultStreams = None
+
+    def __init__( self, seed=None ):
+        if seed is None:
+            seed = random.randint( 0, 2**32 - 1 )
+        self.seed = int( seed ) & 0xffffffff
+        self.streams = {}
+        neuron.h.Random().Random123_globalindex( self.seed )
+
+    @staticmethod
+    def getDefault():
+        ''' Shared instance for cells created outside of a NeuronEnviron '''
+        if RandomStreams.defaultStreams is None:
+            RandomStreams.defaultStreams = RandomStreams()
+        return RandomStreams.defaultStreams
+
+    def getStream( self, gid, synapseId ):
+        '''
+        Get the uniform( 0, 1 ) Random123 stream for a synapse, creating it
+        on first use.
+        '''
+        key = ( gid, synapseId )
+        stream = self.streams.get( key, None )
+        if stream is None:
+            stream = neuron.h.Random()
+            stream.Random123( gid, synapseId, 0 )
+            stream.uniform( 0, 1 )
+            self.streams[ key ] = stream
+        return stream
+
+    def restart( self ):
+        ''' Rewind every stream to its start, e.g. before a new run '''
+        neuron.h.Random().Random123_globalindex( self.seed )
+        for stream in self.streams.values():
+            stream.seq( 0 )
+
+    def releaseCell( self, gid ):
+        ''' Drop the streams of every synapse of a cell '''
+        for key in [ key for key in self.streams if key[ 0 ] == gid ]:
+            del self.streams[ key ]
+
+    def uniform( self, gid, synapseIds, streamId=0 ):
+        '''
+        Counter-based uniform draws in (0, 1), one per synapse ID. The same
+        ( seed, gid, synapse ID, stream ID ) always gives the same value.
+        '''
+        values = np.asarray( synapseIds, dtype=np.int64 ).astype( np.uint64 )
+        # Work on 1-element arrays, which wrap on overflow without warning
+        key = np.array( [ self.seed ], dtype=np.uint64 )
+        key = mix64( mix64( key ) ^ np.uint64( gid & 0xffffffffffffffff ) )
+        key = mix64( key ^ np.uint64( streamId ) )
+        values = mix64( mix64( values ^ key ) )
+        # Top 53 bits, offset by half a step so 0 is never returned
+        return ( ( values >> np.uint64( 11 ) ).astype( np.float64 ) + 0.5 ) * 2.0**-53
+
+    def normal( self, gid, synapseIds, streamId=0 ):
+        ''' Standard normal draws, through the Box-Muller transform '''
+        u1 = self.uniform( gid, synapseIds, 2 * streamId )
+        u2 = self.uniform( gid, synapseIds, 2 * streamId + 1 )
+        return np.sqrt( -2.0 * np.log( u1 ) ) * np.cos( 2.0 * np.pi * u2 )
+
+    def lognormal( self, gid, synapseIds, mean, variance, streamId=0 ):
+        '''
+        Lognormal draws with the given mean and variance, matching the
+        parameterisation of NEURON's Random.lognormal
+        '''
+        sigmaSq = np.log( 1.0 + variance / ( mean * mean ) )
+        mu = np.log( mean ) - sigmaSq / 2.0
+        return np.exp( mu + np.sqrt( sigmaSq ) *
+                       self.normal( gid, synapseIds, streamId ) )
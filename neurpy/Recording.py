@@ -0,0 +1,116 @@
+'''
+Probe recordings of a variable at a segment, with optional decimation.
+'''
+import re
+import numpy as np
+import neuron
+
+# "soma[0](0.5)", "dend[3](0.2)", "soma" ...
+locationPattern = re.compile( r'^\s*(\w+)\s*(?:\[\s*(\d+)\s*\])?\s*(?:\(\s*([\d.]+)\s*\))?\s*$' )
+decimationModes = ( 'none', 'stride', 'minmax' )
+
+
+def resolveLocation( neurCell, loc ):
+    '''
+    Get the segment of a cell at a location given as `section[index](x)`.
+    The index defaults to 0 for section arrays and x to 0.5.
+    '''
+    match = locationPattern.match( loc )
+    if not match:
+        raise ValueError( "Invalid probe location '%s'" % loc )
+    name, idx, x = match.groups()
+    sec = getattr( neurCell, name )
+    if not isinstance( sec, neuron.nrn.Section ):
+        sec = sec[ int( idx or 0 ) ]
+    return sec( float( x ) if x else 0.5 )
+
+
+class Recording( object ):
+    '''
+    Samples one variable (`var`, e.g. 'v', 'ica', 'm_NaTs2_t') at one
+    segment every `interval` ms. With decimation, only every `factor`-th
+    sample is kept ('stride', which just samples less often), or the min
+    and max of each block of `factor` samples ('minmax').
+
+    The NEURON Vector is only a buffer; `drain` moves what it holds into
+    NumPy chunks, decimating along the way, and empties it, so memory
+    grows with the decimated data only. Time is implicit: sample i is at
+    t0 + i * dt, and for 'minmax' covers [ t0 + i * dt, t0 + ( i + 1 ) * dt ).
+    '''
+    def __init__( self, tag, target, segment, var='v', interval=0.1,
+                  decimation='none', factor=1 ):
+        if decimation not in decimationModes:
+            raise ValueError( "Unknown decimation '%s', expected one of %s"
+                              % ( decimation, ", ".join( decimationModes ) ) )
+        self.tag = tag
+        self.target = target
+        self.var = var
+        self.decimation = decimation
+        self.factor = max( int( factor ), 1 ) if decimation != 'none' else 1
+        self.t0 = 0.0
+        self.dt = interval * self.factor
+        self.buffer = neuron.h.Vector()
+        self.sampleInterval = interval * self.factor if decimation == 'stride' else interval
+        self.buffer.record( getattr( segment, '_ref_' + var ), self.sampleInterval )
+        self.reset()
+
+    def reset( self ):
+        ''' Drop everything recorded, e.g. before a new run '''
+        self.chunks = []
+        self.pending = np.empty( 0 )
+
+    def drain( self ):
+        ''' Move the samples buffered so far out of the NEURON Vector '''
+        samples = np.array( self.buffer.as_numpy() )
+        self.buffer.resize( 0 )
+        if self.decimation == 'minmax':
+            # Carry partial blocks over to the next drain
+            samples = np.concatenate( ( self.pending, samples ) )
+            numBlocks = len( samples ) // self.factor
+            self.pending = samples[ numBlocks * self.factor : ]
+            blocks = samples[ 0 : numBlocks * self.factor ].reshape( numBlocks, self.factor )
+            samples = np.stack( ( blocks.min( axis=1 ), blocks.max( axis=1 ) ), axis=1 )
+        if len( samples ):
+            self.chunks.append( samples )
+
+    def finish( self ):
+        ''' Drain the buffer at the end of a run, closing any partial block '''
+        self.drain()
+        if len( self.pending ):
+            self.chunks.append( np.array( [ [ self.pending.min(), self.pending.max() ] ] ) )
+            self.pending = np.empty( 0 )
+
+    def getData( self ):
+        '''
+        All drained samples, as a 1D array, or for 'minmax' an array of
+        ( min, max ) rows
+        '''
+        if not self.chunks:
+            return np.empty( ( 0, 2 ) if self.decimation == 'minmax' else 0 )
+        return np.concatenate( self.chunks )
+
+    def getColumns( self ):
+        ''' ( name, samples ) pairs for output, splitting min/max pairs '''
+        data = self.getData()
+        if self.decimation == 'minmax':
+            return [ ( self.tag + "_min", data[ :, 0 ] ),
+                     ( self.tag + "_max", data[ :, 1 ] ) ]
+        return [ ( self.tag, data ) ]
+
+    def takeColumns( self ):
+        ''' Like `getColumns`, but drops the samples returned '''
+        columns = self.getColumns()
+        self.chunks = []
+        return columns
+
+    @property
+    def timebase( self ):
+        '''
+        Key shared by recordings whose samples line up: same t0 and dt, and
+        for min/max blocks, built from the same sampling
+        '''
+        return ( self.t0, self.dt, self.decimation == 'minmax', self.sampleInterval )
+
+    def getTimes( self ):
+        ''' Time of each drained sample '''
+        return self.t0 + self.dt * np.arange( sum( len( chunk ) for chunk in self.chunks ) )
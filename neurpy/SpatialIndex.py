@@ -0,0 +1,135 @@
+'''
+Uniform-grid spatial index for radius and nearest-neighbour queries.
+'''
+import numpy as np
+
+
+def expandRanges( starts, lengths ):
+    ''' Concatenate arange( s, s + l ) for each start/length pair '''
+    lengths = np.asarray( lengths, dtype=np.int64 )
+    total = int( lengths.sum() )
+    if total == 0:
+        return np.empty( 0, dtype=np.int64 )
+    ends = np.cumsum( lengths )
+    shifts = np.repeat( np.asarray( starts, dtype=np.int64 ) - ( ends - lengths ), lengths )
+    return shifts + np.arange( total, dtype=np.int64 )
+
+
+class SpatialIndex( object ):
+    '''
+    Buckets a set of 3D points into a uniform grid so that points near a
+    query only need to be compared against the few grid cells around it.
+    Points are referred to by their row in the `points` array the index
+    was built from.
+
+    `cellSize` is the edge length of a grid cell (in µm for morphologies);
+    by default it is picked so that each occupied cell holds a handful of
+    points.
+    '''
+    queryChunk = 256
+
+    def __init__( self, points, cellSize=None ):
+        self.points = np.asarray( points, dtype=np.float64 ).reshape( -1, 3 )
+        if len( self.points ) == 0:
+            self.origin = np.zeros( 3 )
+            extent = np.zeros( 3 )
+        else:
+            self.origin = self.points.min( axis=0 )
+            extent = self.points.max( axis=0 ) - self.origin
+
+        if cellSize is None:
+            # Aim for ~4 points per cell, assuming an even spread
+            volume = np.prod( np.maximum( extent, 1.0 ) )
+            cellSize = np.cbrt( 4.0 * volume / max( len( self.points ), 1 ) )
+        self.cellSize = max( float( cellSize ), 1e-6 )
+        self.dims = np.floor( extent / self.cellSize ).astype( np.int64 ) + 1
+
+        keys = self.__cellKeys( self.__cellCoords( self.points ) )
+        self.order = np.argsort( keys, kind='stable' )
+        self.sortedKeys = keys[ self.order ]
+
+    def __len__( self ):
+        return len( self.points )
+
+    def __cellCoords( self, points ):
+        return np.floor( ( points - self.origin ) / self.cellSize ).astype( np.int64 )
+
+    def __cellKeys( self, coords ):
+        return ( coords[ ..., 0 ] * self.dims[ 1 ] + coords[ ..., 1 ] ) * self.dims[ 2 ] + coords[ ..., 2 ]
+
+    def __pointsNear( self, centres, reach ):
+        '''
+        Get ( centre index, point index ) pairs for every point sharing a
+        grid cell with, or within `reach` cells of, each centre
+        '''
+        offsets = np.arange( -reach, reach + 1 )
+        offsets = np.stack( np.meshgrid( offsets, offsets, offsets,
+                                         indexing='ij' ), axis=-1 ).reshape( -1, 3 )
+        coords = self.__cellCoords( centres )[ :, None, : ] + offsets[ None, :, : ]
+        inGrid = np.all( ( coords >= 0 ) & ( coords < self.dims ), axis=-1 )
+        centreIdx = np.nonzero( inGrid )[ 0 ]
+        keys = self.__cellKeys( coords[ inGrid ] )
+
+        starts = np.searchsorted( self.sortedKeys, keys, side='left' )
+        ends = np.searchsorted( self.sortedKeys, keys, side='right' )
+        counts = ends - starts
+        pointIdx = self.order[ expandRanges( starts, counts ) ]
+        return np.repeat( centreIdx, counts ), pointIdx
+
+    def queryRadius( self, centres, radius ):
+        '''
+        Find all points within `radius` of any of the given centres.
+        Returns ( indices, distances ), where `distances` is the distance
+        from each found point to its closest centre; both are ordered by
+        increasing distance.
+        '''
+        centres = np.asarray( centres, dtype=np.float64 ).reshape( -1, 3 )
+        bestDist = np.full( len( self.points ), np.inf )
+        if len( self.points ) == 0 or len( centres ) == 0:
+            return np.empty( 0, dtype=np.int64 ), np.empty( 0 )
+
+        reach = int( np.ceil( radius / self.cellSize ) )
+        # Once the search box spans more grid cells than the grid has, just
+        # compare against every point
+        numOffsets = ( 2 * reach + 1 )**3
+        bruteForce = numOffsets >= np.prod( self.dims )
+        pointsSq = np.einsum( 'ij,ij->i', self.points, self.points )
+        # Bound the number of ( centre, grid cell ) pairs looked at at once
+        chunkSize = SpatialIndex.queryChunk if bruteForce else \
+                    max( 1, min( SpatialIndex.queryChunk, 2**20 // numOffsets ) )
+        for start in range( 0, len( centres ), chunkSize ):
+            chunk = centres[ start : start + chunkSize ]
+            if bruteForce:
+                chunkSq = np.einsum( 'ij,ij->i', chunk, chunk )
+                distSq = chunkSq[ :, None ] + pointsSq[ None, : ] - 2.0 * ( chunk @ self.points.T )
+                dists = np.sqrt( np.maximum( distSq.min( axis=0 ), 0.0 ) )
+                np.minimum( bestDist, dists, out=bestDist )
+            else:
+                centreIdx, pointIdx = self.__pointsNear( chunk, reach )
+                dists = np.linalg.norm( self.points[ pointIdx ] - chunk[ centreIdx ], axis=1 )
+                np.minimum.at( bestDist, pointIdx, dists )
+
+        found = np.flatnonzero( bestDist <= radius )
+        order = np.argsort( bestDist[ found ], kind='stable' )
+        return found[ order ], bestDist[ found[ order ] ]
+
+    def nearest( self, centres, k ):
+        '''
+        Find the `k` points closest to any of the given centres. Returns
+        ( indices, distances ) ordered by increasing distance.
+        '''
+        centres = np.asarray( centres, dtype=np.float64 ).reshape( -1, 3 )
+        k = min( k, len( self.points ) )
+        if k <= 0 or len( centres ) == 0:
+            return np.empty( 0, dtype=np.int64 ), np.empty( 0 )
+
+        # Grow the search radius until enough points have been found; the
+        # last radius covers the whole index
+        maxRadius = np.linalg.norm( self.dims * self.cellSize ) + \
+                    np.max( np.linalg.norm( centres - self.origin, axis=1 ) )
+        radius = self.cellSize
+        while True:
+            indices, dists = self.queryRadius( centres, radius )
+            if len( indices ) >= k or radius >= maxRadius:
+                return indices[ 0 : k ], dists[ 0 : k ]
+            radius = min( radius * 2.0, maxRadius )
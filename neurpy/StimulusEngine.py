@@ -0,0 +1,100 @@
+'''
+Batched symbol updates for a network's stimuli.
+'''
+import numpy as np
+
+
+class StimulusEngine( object ):
+    '''
+    Holds the symbol probability and on/off state of every stimulus of a
+    network in arrays, and draws the next symbol of all of them at once.
+
+    Draws come from a NumPy Generator seeded from the network seed, one per
+    stimulus in the topology file (`totalStimuli`), whichever stimuli this
+    rank holds, so a seed gives the same symbols however the network is
+    distributed. The symbol history is kept in an array preallocated for
+    the run length by `reset`.
+
+    Instead of calling `update` during the run, `schedule` can draw the
+    whole run's symbols beforehand and leave the switching to NEURON.
+    '''
+    def __init__( self, seed, stream=0 ):
+        self.seed = seed
+        self.stream = stream
+        self.count = 0
+        self.totalStimuli = 0
+        self.cellStims = []
+        self.probabilities = np.ones( 8 )
+        self.globalIndices = np.zeros( 8, dtype=np.int64 )
+        self.active = np.zeros( 0, dtype=bool )
+        self.history = np.zeros( ( 0, 0 ), dtype=np.int8 )
+        self.step = 0
+        self.rng = None
+
+    def addStimulus( self, cellStim, globalIndex ):
+        ''' Take over a CellStim's state, returning its slot '''
+        slot = self.count
+        if slot == len( self.probabilities ):
+            self.probabilities = np.concatenate( ( self.probabilities, np.ones( slot ) ) )
+            self.globalIndices = np.concatenate( ( self.globalIndices,
+                                                   np.zeros( slot, dtype=np.int64 ) ) )
+        self.probabilities[ slot ] = cellStim.symbolProbability
+        self.globalIndices[ slot ] = globalIndex
+        self.totalStimuli = max( self.totalStimuli, globalIndex + 1 )
+        self.cellStims.append( cellStim )
+        self.count += 1
+        cellStim.attachEngine( self, slot )
+        return slot
+
+    def reset( self, tstop, symbolTimeStep ):
+        ''' Restart the symbol sequence and history, e.g. before a run '''
+        self.rng = np.random.default_rng( [ self.seed, self.stream ] )
+        numSteps = int( tstop // symbolTimeStep ) + 2
+        self.history = np.zeros( ( numSteps, self.count ), dtype=np.int8 )
+        self.step = 0
+        # Drop any schedule from an earlier run; stimuli start off
+        for cellStim in self.cellStims:
+            cellStim.playActive( (), () )
+            cellStim.active = False
+        self.active = np.zeros( self.count, dtype=bool )
+
+    def update( self ):
+        ''' Draw the next symbol of every stimulus, switching those that change '''
+        if self.rng is None:
+            self.reset( 0, 1 )
+        draws = self.rng.random( self.totalStimuli )[ self.globalIndices[ 0 : self.count ] ]
+        active = self.probabilities[ 0 : self.count ] > draws
+        for slot in np.flatnonzero( active != self.active ).tolist():
+            self.cellStims[ slot ].setActive( bool( active[ slot ] ) )
+        self.active = active
+
+        if self.step == len( self.history ):
+            self.history = np.concatenate( ( self.history, np.zeros_like( self.history ) ) ) \
+                            if len( self.history ) else np.zeros( ( 1, self.count ), dtype=np.int8 )
+        self.history[ self.step ] = active
+        self.step += 1
+
+    def schedule( self, tstop, symbolTimeStep ):
+        '''
+        Draw the symbols of a whole run up front, as `update` would every
+        `symbolTimeStep` from t=0, and have each stimulus switched at those
+        times by events queued at initialisation, so no Python runs inside
+        the integration loop.
+        '''
+        self.reset( tstop, symbolTimeStep )
+        numSteps = int( tstop // symbolTimeStep ) + 1
+        # Row k holds the same draws the k-th `update` would make
+        draws = self.rng.random( ( numSteps, self.totalStimuli ) )
+        active = self.probabilities[ 0 : self.count ] > draws[ :, self.globalIndices[ 0 : self.count ] ]
+        self.history = active.astype( np.int8 )
+        self.step = numSteps
+
+        times = np.arange( numSteps, dtype=np.float64 ) * symbolTimeStep
+        previous = np.vstack( ( self.active[ None, : ], active[ 0 : -1 ] ) )
+        for slot, cellStim in enumerate( self.cellStims ):
+            changes = np.flatnonzero( active[ :, slot ] != previous[ :, slot ] )
+            cellStim.playActive( times[ changes ], active[ changes, slot ] )
+
+    def getHistory( self, slot ):
+        ''' Symbols of one stimulus so far, 1 for active '''
+        return self.history[ 0 : self.step, slot ]
@@ -0,0 +1,100 @@
+'''
+Strategies for choosing which synapses of a target cell a connection uses.
+
+A strategy is a function
+
+    strategy( sourceCell, targetCell, synType, count, **kwargs )
+
+returning an array of at most `count` row indices into the target cell's
+synapse table, drawn from its inhibitory (synType 1) or excitatory
+synapses. Strategies are looked up by name in `selectionStrategies`, and
+new ones can be added with `registerStrategy`.
+'''
+import numpy as np
+
+
+def selectByFac( sourceCell, targetCell, synType, count, column='fac' ):
+    ''' Synapses in order of increasing facilitation (or another column) '''
+    ordering = targetCell.synapses.table.getOrdering( synType, column )
+    return ordering[ 0 : count ]
+
+
+def selectRandom( sourceCell, targetCell, synType, count, seed=None ):
+    ''' A uniformly random subset of synapses '''
+    indices = targetCell.synapses.table.getIndices( synType )
+    count = min( count, len( indices ) )
+    rng = np.random.default_rng( seed )
+    return indices[ rng.choice( len( indices ), size=count, replace=False ) ]
+
+
+def selectBySectionList( sourceCell, targetCell, synType, count,
+                         sectionlistIds=( 1, ), column='fac' ):
+    '''
+    Synapses placed on the given section lists (0 somatic, 1 basal,
+    2 apical, 3 axonal), in order of increasing `column`
+    '''
+    ordering = targetCell.synapses.table.getOrdering( synType, column,
+                                                      sectionlistIds )
+    return ordering[ 0 : count ]
+
+
+def selectByDistance( sourceCell, targetCell, synType, count, radius=50.0,
+                      centre=None ):
+    '''
+    Synapses within `radius` µm of the source cell's axon, closest first,
+    in the manner of touch detection; an infinite radius just takes the
+    closest. If `centre` is given, distances are measured from that point
+    instead (e.g. for stimuli, which have no source cell).
+    '''
+    if centre is not None:
+        axonPoints = np.asarray( centre, dtype=np.float64 ).reshape( 1, 3 )
+    else:
+        axonPoints = sourceCell.getAxonPoints()
+    if len( axonPoints ) == 0:
+        return np.empty( 0, dtype=np.int64 )
+
+    # Skip the index entirely for cells that are too far apart to touch
+    targetMin, targetMax = targetCell.getBounds()
+    gap = np.maximum( 0.0, np.maximum( axonPoints.min( axis=0 ) - targetMax,
+                                       targetMin - axonPoints.max( axis=0 ) ) )
+    if np.linalg.norm( gap ) > radius:
+        return np.empty( 0, dtype=np.int64 )
+
+    index, rows = targetCell.getSynapseIndex( synType )
+    if not np.isfinite( radius ):
+        found, _ = index.nearest( axonPoints, count )
+        return rows[ found ]
+    found, _ = index.queryRadius( axonPoints, radius )
+    return rows[ found[ 0 : count ] ]
+
+
+def selectNearest( sourceCell, targetCell, synType, count ):
+    ''' The synapses closest to the source cell's axon '''
+    index, rows = targetCell.getSynapseIndex( synType )
+    found, _ = index.nearest( sourceCell.getAxonPoints(), count )
+    return rows[ found ]
+
+
+selectionStrategies = {
+    'fac' : selectByFac,
+    'random' : selectRandom,
+    'sectionList' : selectBySectionList,
+    'distance' : selectByDistance,
+    'nearest' : selectNearest,
+}
+
+
+def registerStrategy( name, strategy ):
+    selectionStrategies[ name ] = strategy
+
+
+def selectSynapses( strategy, sourceCell, targetCell, synType, count, **kwargs ):
+    '''
+    Run a selection strategy, given either by name or as a function
+    '''
+    if not callable( strategy ):
+        if strategy not in selectionStrategies:
+            raise ValueError( "Unknown synapse selection strategy '%s'" % strategy )
+        strategy = selectionStrategies[ strategy ]
+    count = max( 0, count )
+    return strategy( sourceCell, targetCell, synType, count, **kwargs )
@@ -0,0 +1,168 @@
+'''
+Columnar loading of the per-cell synapses.tsv files.
+'''
+import csv
+import os
+import numpy as np
+
+# Columns of synapses.tsv, in file order
+synapseDtype = np.dtype( [
+    ( 'synapseId', np.int32 ),
+    ( 'preCellId', np.int32 ),
+    ( 'preMType', np.int32 ),
+    ( 'sectionlistId', np.int32 ),
+    ( 'sectionlistIdx', np.int32 ),
+    ( 'segX', np.float64 ),
+    ( 'synType', np.int32 ),
+    ( 'dep', np.float64 ),
+    ( 'fac', np.float64 ),
+    ( 'use', np.float64 ),
+    ( 'tau_d', np.float64 ),
+    ( 'delay', np.float64 ),
+    ( 'weight', np.float64 ),
+] )
+
+
+def getCachePath( synInfoPath ):
+    ''' The compiled cache lives next to the TSV it was built from '''
+    return os.path.splitext( synInfoPath )[ 0 ] + ".npy"
+
+
+def parseSynapseFile( synInfoPath ):
+    '''
+    Parse a synapses.tsv file into a structured array of `synapseDtype`.
+    Returns None if the file holds no synapse rows, and raises a ValueError
+    if a row is missing fields.
+    '''
+    numFields = len( synapseDtype )
+    rows = []
+    with open( synInfoPath, 'r' ) as synFile:
+        synReader = csv.reader( synFile, delimiter='\t' )
+        # Skip the header
+        next( synReader, None )
+        for row in synReader:
+            if not row:
+                continue
+            if len( row ) < numFields:
+                raise ValueError( "%s:%i: Expected %i synapse fields, found %i"
+                                  % ( synInfoPath, synReader.line_num, numFields, len( row ) ) )
+            rows.append( tuple( row[ 0 : numFields ] ) )
+    if not rows:
+        return None
+    # Let NumPy do the string conversion a column at a time
+    columns = list( zip( *rows ) )
+    table = np.empty( len( rows ), dtype=synapseDtype )
+    for name, column in zip( synapseDtype.names, columns ):
+        table[ name ] = np.array( column ).astype( synapseDtype[ name ] )
+    return table
+
+
+def loadSynapseTable( synInfoPath ):
+    '''
+    Load the synapse table for a synapses.tsv file, going through a compiled
+    .npy cache stored beside it. The cache is memory-mapped read-only, and
+    is rebuilt whenever its mtime no longer matches that of the TSV (the
+    cache's mtime is stamped with the source's when it is written).
+    Returns None if the file could not be loaded.
+    '''
+    cachePath = getCachePath( synInfoPath )
+    srcStat = os.stat( synInfoPath )
+    try:
+        cacheStat = os.stat( cachePath )
+        if cacheStat.st_mtime_ns == srcStat.st_mtime_ns:
+            table = np.load( cachePath, mmap_mode='r' )
+            if table.dtype == synapseDtype:
+                return table
+    except ( OSError, ValueError ):
+        pass
+
+    table = parseSynapseFile( synInfoPath )
+    if table is None:
+        return None
+
+    # Write to a temporary file first so concurrent simulations never see
+    # a partially written cache
+    tmpPath = "%s.%i.tmp" % ( cachePath, os.getpid() )
+    try:
+        with open( tmpPath, 'wb' ) as cacheFile:
+            np.save( cacheFile, table )
+        os.utime( tmpPath, ns=( srcStat.st_atime_ns, srcStat.st_mtime_ns ) )
+        os.replace( tmpPath, cachePath )
+    except OSError as err:
+        print( "Warning: Could not write synapse cache %s (%s)" % ( cachePath, err ) )
+        if os.path.exists( tmpPath ):
+            os.remove( tmpPath )
+        return table
+
+    return np.load( cachePath, mmap_mode='r' )
+
+
+class SynapseTable( object ):
+    '''
+    Immutable columnar synapse data for one cell type. Tables are shared
+    between every cell loaded from the same synapses.tsv, so get them
+    through `SynapseTable.load` rather than constructing them directly.
+
+    `data` is a read-only structured array of `synapseDtype`, and
+    `excIndices`/`inhIndices` hold the row indices of the excitatory and
+    inhibitory synapses (synapse_type >= 100 and < 100 respectively).
+    '''
+    loadedTables = {}
+
+    def __init__( self, data ):
+        if data.flags.writeable:
+            data.flags.writeable = False
+        self.data = data
+        isInh = data[ 'synType' ] < 100
+        self.inhIndices = np.flatnonzero( isInh )
+        self.excIndices = np.flatnonzero( ~isInh )
+        self.inhIndices.flags.writeable = False
+        self.excIndices.flags.writeable = False
+        self.orderings = {}
+
+    def __len__( self ):
+        return len( self.data )
+
+    def getIndices( self, synType ):
+        ''' Row indices of the inhibitory (synType 1) or excitatory synapses '''
+        return self.inhIndices if synType == 1 else self.excIndices
+
+    def getOrdering( self, synType, column='fac', sectionlistIds=None ):
+        '''
+        Get the row indices of the inhibitory (synType 1) or excitatory
+        synapses, optionally restricted to the given section lists, sorted
+        by increasing `column`. Ties keep file order. Orderings are computed
+        once per table and shared by every cell of the type.
+        '''
+        if sectionlistIds is not None:
+            sectionlistIds = tuple( sorted( sectionlistIds ) )
+        key = ( synType == 1, column, sectionlistIds )
+        ordering = self.orderings.get( key, None )
+        if ordering is None:
+            indices = self.getIndices( synType )
+            if sectionlistIds is not None:
+                inLists = np.isin( self.data[ 'sectionlistId' ][ indices ],
+                                   sectionlistIds )
+                indices = indices[ inLists ]
+            order = np.argsort( self.data[ column ][ indices ], kind='stable' )
+            ordering = indices[ order ]
+            ordering.flags.writeable = False
+            self.orderings[ key ] = ordering
+        return ordering
+
+    @staticmethod
+    def load( synInfoPath ):
+        '''
+        Get the shared table for a synapses.tsv file, loading it on first
+        use. Returns an empty table if the file could not be loaded.
+        '''
+        key = os.path.realpath( synInfoPath )
+        table = SynapseTable.loadedTables.get( key, None )
+        if table is None:
+            data = loadSynapseTable( synInfoPath )
+            if data is None:
+                print( "Error: Could not load synapse file %s " % synInfoPath )
+                data = np.empty( 0, dtype=synapseDtype )
+            table = SynapseTable( data )
+            SynapseTable.loadedTables[ key ] = table
+        return table
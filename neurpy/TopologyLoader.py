@@ -0,0 +1,84 @@
+'''
+Streaming reader for pseudo-GEXF network topology files.
+'''
+from xml.etree.ElementTree import iterparse, tostring
+
+# Elements that describe the network, and the attributes each must have
+topologyTags = {
+    'cell' : ( 'id', 'cellType' ),
+    'edge' : ( 'source', 'target' ),
+    'stim' : ( 'target', ),
+    'probe' : ( 'target', ),
+}
+
+
+def getAttribute( attrib, name, convert, default=None ):
+    '''
+    Get an element attribute converted with `convert` (int, float, str), or
+    `default` if it is missing or empty. Values may be text, from XML
+    topologies, or already typed, from binary ones, so a value of 0 counts
+    as given.
+    '''
+    value = attrib.get( name, None )
+    if value is None or value == '':
+        return default
+    return convert( value )
+
+
+def iterTopology( filePath, extras=None ):
+    '''
+    Stream the cells, edges, stimuli and probes of a topology file, yielding
+    a ( tag, attributes ) pair for each in file order. Elements are dropped
+    from the tree once handled, so memory use doesn't grow with the file.
+
+    References are checked as the file is read: edges, stimuli and probes
+    must refer to a cell declared earlier in the file, and cell IDs must be
+    unique. A ValueError is raised for anything that doesn't check out.
+
+    If `extras` is a dict it is filled in with the rest of the file: the
+    root element's tag and attributes ('root', 'rootAttrib'), the <graph>
+    attributes ('graphAttrib') and the <meta> element as an XML string
+    ('meta'), so that the file can be reproduced.
+    '''
+    cellIds = set()
+    parents = []
+    for event, elem in iterparse( filePath, events=( 'start', 'end' ) ):
+        if event == 'start':
+            if extras is not None:
+                if not parents:
+                    extras[ 'root' ] = elem.tag
+                    extras[ 'rootAttrib' ] = dict( elem.attrib )
+                elif elem.tag == 'graph':
+                    extras[ 'graphAttrib' ] = dict( elem.attrib )
+            parents.append( elem )
+            continue
+
+        parents.pop()
+        tag = elem.tag
+        if tag == 'meta' and extras is not None:
+            extras[ 'meta' ] = tostring( elem, encoding='unicode' ).strip()
+        if tag not in topologyTags:
+            continue
+
+        attrib = dict( elem.attrib )
+        for name in topologyTags[ tag ]:
+            if not attrib.get( name, '' ):
+                raise ValueError( "%s: <%s> element is missing the '%s' attribute"
+                                  % ( filePath, tag, name ) )
+
+        if tag == 'cell':
+            if attrib[ 'id' ] in cellIds:
+                raise ValueError( "%s: Duplicate cell ID '%s'" % ( filePath, attrib[ 'id' ] ) )
+            cellIds.add( attrib[ 'id' ] )
+        else:
+            refs = ( 'source', 'target' ) if tag == 'edge' else ( 'target', )
+            for ref in refs:
+                if attrib[ ref ] not in cellIds:
+                    raise ValueError( "%s: <%s> %s refers to unknown cell '%s'"
+                                      % ( filePath, tag, ref, attrib[ ref ] ) )
+
+        yield tag, attrib
+
+        # Drop everything parsed so far under the container
+        if parents:
+            del parents[ -1 ][ : ]
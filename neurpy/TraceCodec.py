@@ -0,0 +1,153 @@
+'''
+Encodings of sample columns for the binary output files, trading
+precision for size.
+
+Largest reconstruction error of each codec, per sample:
+    raw      0 (samples are stored as they are)
+    float32  half a float32 ULP: |x| * 2**-24 (6e-6 mV at 100 mV)
+    int16    resolution / 2, for |x| <= 32767 * resolution
+    delta    resolution / 2, for |x| <= 2147483647 * resolution
+(the last two are also off by float64 rounding, at most |x| * 2**-51).
+Resolutions are in the units of the recorded variable, e.g. mV for 'v'.
+Values int16 or delta can't hold within their error raise a ValueError
+rather than being clipped.
+'''
+import zlib
+import numpy as np
+
+codecNames = ( 'raw', 'float32', 'int16', 'delta' )
+
+
+class TraceCodec( object ):
+    '''
+    Base class for codecs. `encode` turns a 1D array of samples into bytes,
+    `decode` turns them back into `numSamples` samples of type `dtype`.
+    '''
+    name = 'raw'
+
+    def __init__( self, dtype=np.float64 ):
+        self.dtype = np.dtype( dtype ).newbyteorder( '<' )
+
+    def getSpec( self ):
+        ''' Description of the codec for file headers '''
+        return { 'name' : self.name }
+
+    def encode( self, samples ):
+        # Contiguous samples of the right type go out without a copy
+        return np.ascontiguousarray( samples, dtype=self.dtype )
+
+    def decode( self, data, numSamples ):
+        return np.frombuffer( data, dtype=self.dtype, count=numSamples )
+
+    def maxError( self, samples ):
+        ''' Largest error `decode` may make on `samples` '''
+        return 0.0
+
+    def verify( self, samples, data ):
+        ''' Check that encoded `data` decodes to `samples` within `maxError` '''
+        decoded = self.decode( data, len( samples ) )
+        if len( samples ) == 0:
+            return
+        error = np.max( np.abs( decoded.astype( np.float64 ) - samples ) )
+        if not error <= self.maxError( samples ):
+            raise ValueError( "%s codec error %g exceeds its bound %g"
+                              % ( self.name, error, self.maxError( samples ) ) )
+
+
+class Float32Codec( TraceCodec ):
+    ''' Samples rounded to float32 '''
+    name = 'float32'
+
+    def encode( self, samples ):
+        return np.ascontiguousarray( samples, dtype='<f4' )
+
+    def decode( self, data, numSamples ):
+        return np.frombuffer( data, dtype='<f4', count=numSamples ).astype( self.dtype )
+
+    def maxError( self, samples ):
+        largest = float( np.max( np.abs( samples ) ) ) if len( samples ) else 0.0
+        # Below float32's smallest normal value, the error is absolute
+        return largest * 2.0**-24 + 2.0**-150
+
+
+class QuantisedCodec( TraceCodec ):
+    ''' Base class for codecs storing samples as multiples of `resolution` '''
+    intType = np.dtype( '<i2' )
+
+    def __init__( self, dtype=np.float64, resolution=0.01 ):
+        super().__init__( dtype )
+        if not resolution > 0:
+            raise ValueError( "%s codec resolution must be positive, not %s"
+                              % ( self.name, resolution ) )
+        self.resolution = float( resolution )
+
+    def getSpec( self ):
+        return { 'name' : self.name, 'resolution' : self.resolution }
+
+    def quantise( self, samples ):
+        steps = np.rint( np.asarray( samples, dtype=np.float64 ) / self.resolution )
+        limit = np.iinfo( self.intType ).max
+        if len( steps ) and not np.max( np.abs( steps ) ) <= limit:
+            raise ValueError( "%s codec can't hold values beyond +-%g at resolution %g"
+                              % ( self.name, limit * self.resolution, self.resolution ) )
+        return steps.astype( self.intType )
+
+    def maxError( self, samples ):
+        # Half a step, plus the rounding of the scaling itself
+        largest = float( np.max( np.abs( samples ) ) ) if len( samples ) else 0.0
+        return 0.5 * self.resolution + largest * 2.0**-51
+
+
+class Int16Codec( QuantisedCodec ):
+    ''' Fixed-point samples, as int16 multiples of `resolution` '''
+    name = 'int16'
+
+    def encode( self, samples ):
+        return self.quantise( samples )
+
+    def decode( self, data, numSamples ):
+        steps = np.frombuffer( data, dtype=self.intType, count=numSamples )
+        return ( steps * self.resolution ).astype( self.dtype )
+
+
+class DeltaCodec( QuantisedCodec ):
+    '''
+    Fixed-point samples, stored as the zlib-compressed differences between
+    consecutive samples. Slowly changing traces give small, repetitive
+    differences, which compress well.
+    '''
+    name = 'delta'
+    intType = np.dtype( '<i4' )
+
+    def __init__( self, dtype=np.float64, resolution=0.01, level=6 ):
+        super().__init__( dtype, resolution )
+        self.level = level
+
+    def encode( self, samples ):
+        steps = self.quantise( samples )
+        deltas = np.diff( steps, prepend=self.intType.type( 0 ) )
+        return zlib.compress( deltas.tobytes(), self.level )
+
+    def decode( self, data, numSamples ):
+        deltas = np.frombuffer( zlib.decompress( data ), dtype=self.intType, count=numSamples )
+        # Differences that overflowed int32 wrapped around; so do the sums
+        steps = np.cumsum( deltas, dtype=self.intType )
+        return ( steps * self.resolution ).astype( self.dtype )
+
+
+codecTypes = { 'raw' : TraceCodec, 'float32' : Float32Codec,
+               'int16' : Int16Codec, 'delta' : DeltaCodec }
+
+
+def createCodec( spec, dtype=np.float64 ):
+    '''
+    Create a codec from its name or a header spec ( { 'name', ... } ), for
+    samples of type `dtype`
+    '''
+    if isinstance( spec, str ):
+        spec = { 'name' : spec }
+    spec = dict( spec )
+    codecType = codecTypes.get( spec.pop( 'name' ), None )
+    if codecType is None:
+        raise ValueError( "Unknown trace codec, expected one of %s" % ", ".join( codecNames ) )
+    return codecType( dtype, **spec )
@@ -1,5 +1,10 @@
 import neuron
-from random import shuffle, randint
+import numpy as np
+from neurpy.CellGeometry import CellGeometry, asRotationMatrix, matrixToEuler
+from neurpy.RandomStreams import RandomStreams
+from neurpy.SpatialIndex import SpatialIndex
+from neurpy.SynapseSelection import selectSynapses
+from neurpy.SynapseTable import SynapseTable
 
 
 class pyCell():
@@ -12,15 +17,21 @@ class pyCell():
         print( "Calling %s" % neuronCall )
         self.neurCell = eval( neuronCall )
         self.cellName = cellName
+        self.geometry = CellGeometry( self.neurCell )
         self.boundingSize = self.getSize()
         self.position = [ 0.0, 0.0, 0.0 ]
         self.rotation = [ 0.0, 0.0, 0.0 ] #Euler rotation (for now)
-        self.children = []
-        self.parents = []
+        self.rotationMatrix = np.eye( 3 )
         self.synapses = None
+        self.gid = kwargs.get( "gid", 0 )
+        # Spatial data derived from the geometry, rebuilt after transforms
+        self.synapsePositions = None
+        self.synapseIndices = {}
+        self.spikeDetector = None
 
-    def loadCellSynapses( self, synapsePath ):
-        self.synapses = Synapses( synapsePath, self.neurCell )
+    def loadCellSynapses( self, synapsePath, randomStreams=None ):
+        self.synapses = Synapses( synapsePath, self.neurCell, randomStreams,
+                                  self.gid )
 
     
     def tempStim( self ):
@@ -40,135 +51,174 @@ class pyCell():
         '''
         Get the bounding-box dimensions of this cell
         '''
-        initSec = [ sec for sec in self.neurCell.all ][ 0 ]
-        xPos = neuron.h.x3d( 0, sec=initSec )
-        yPos = neuron.h.y3d( 0, sec=initSec )
-        zPos = neuron.h.z3d( 0, sec=initSec )
-
-        minmax = [ [ xPos, xPos ], [ yPos, yPos ], [ zPos, zPos ] ]
-
-        for sec in self.neurCell.all:
-            for i in range( 0, int( neuron.h.n3d( sec=sec ) ) ):
-                xPos = neuron.h.x3d( i, sec=sec )
-                yPos = neuron.h.y3d( i, sec=sec )
-                zPos = neuron.h.z3d( i, sec=sec )
-                minmax[ 0 ][ 0 ] = min( minmax[ 0 ][ 0 ], xPos )
-                minmax[ 0 ][ 1 ] = max( minmax[ 0 ][ 1 ], xPos )
-                minmax[ 1 ][ 0 ] = min( minmax[ 1 ][ 0 ], yPos )
-                minmax[ 1 ][ 1 ] = max( minmax[ 1 ][ 1 ], yPos )
-                minmax[ 2 ][ 0 ] = min( minmax[ 2 ][ 0 ], zPos )
-                minmax[ 2 ][ 1 ] = max( minmax[ 2 ][ 1 ], zPos )
-
-        xSize = minmax[ 0 ][ 1 ] - minmax[ 0 ][ 0 ]
-        ySize = minmax[ 1 ][ 1 ] - minmax[ 1 ][ 0 ]
-        zSize = minmax[ 2 ][ 1 ] - minmax[ 2 ][ 0 ]
-        return ( xSize, ySize, zSize )
+        return self.geometry.getSize()
+
+    def getBounds( self ):
+        '''
+        Get the ( min, max ) xyz corners of the bounding box of this cell
+        '''
+        return self.geometry.getBounds()
 
     def translate( self, translation ):
         ''' 
         Translate this Cell instance by a given amount.
         Input is a list with xyz translation points.
         '''
-
-        for sec in self.neurCell.all:
-           # print( "%s -> %i" % ( sec.name(), sec.L ) )
-            for i in range( 0, int( neuron.h.n3d( sec=sec ) ) ):
-                xNew = neuron.h.x3d( i, sec=sec ) + translation[ 0 ]
-                yNew = neuron.h.y3d( i, sec=sec ) + translation[ 1 ]
-                zNew = neuron.h.z3d( i, sec=sec ) + translation[ 2 ]
-                diam = neuron.h.diam3d( i, sec=sec )
-                neuron.h.pt3dchange( i, xNew, yNew, zNew, diam, sec=sec )
+        self.geometry.translate( translation )
+        self.clearSpatialCache()
         self.position[ 0 ] += translation[ 0 ]
         self.position[ 1 ] += translation[ 1 ]
         self.position[ 2 ] += translation[ 2 ]
 
-    def addChild( self, targetCell, synType, conCount, weight, delay, threshold=None ):
-        ''' 
-        Connect to `prop` random cells for both excitatory and
-        inhibitory
-        ''' 
+    def transform( self, rotation=None, translation=None ):
+        '''
+        Rotate this cell about its position and then translate it.
+        `rotation` is either xyz Euler angles in radians or a 3x3 rotation
+        matrix; `translation` is an xyz offset.
+        '''
+        pyCell.transformMany( [ self ], [ rotation ], [ translation ] )
+
+    @staticmethod
+    def transformMany( cells, rotations=None, translations=None ):
+        '''
+        Apply `transform` to a batch of cells at once. `rotations` and
+        `translations` are per-cell lists; either may be omitted, and
+        individual entries may be None for no rotation/translation.
+        '''
+        numCells = len( cells )
+        rotations = rotations if rotations is not None else [ None ] * numCells
+        translations = translations if translations is not None else [ None ] * numCells
+
+        matrices = [ asRotationMatrix( rot ) if rot is not None else np.eye( 3 )
+                        for rot in rotations ]
+        translations = [ trans if trans is not None else [ 0.0, 0.0, 0.0 ]
+                            for trans in translations ]
+        origins = [ cell.position for cell in cells ]
+        CellGeometry.transformMany( [ cell.geometry for cell in cells ],
+                                    matrices, translations, origins )
+
+        for cell, matrix, translation in zip( cells, matrices, translations ):
+            cell.clearSpatialCache()
+            cell.rotationMatrix = matrix @ cell.rotationMatrix
+            cell.rotation = matrixToEuler( cell.rotationMatrix )
+            for i in range( 3 ):
+                cell.position[ i ] += translation[ i ]
+
+    def clearSpatialCache( self ):
+        self.synapsePositions = None
+        self.synapseIndices = {}
+
+    def getSynapsePositions( self ):
+        '''
+        Get the xyz position of every synapse in the synapse table, with NaN
+        for synapses on sections that have no 3D points
+        '''
+        if self.synapsePositions is None:
+            self.synapsePositions = self.synapses.getPositions( self.geometry )
+        return self.synapsePositions
+
+    def getSynapseIndex( self, synType ):
+        '''
+        Get a SpatialIndex over the positions of the inhibitory (synType 1)
+        or excitatory synapses, along with the synapse table row of each
+        point in the index, as ( index, rows )
+        '''
+        key = ( synType == 1 )
+        entry = self.synapseIndices.get( key, None )
+        if entry is None:
+            rows = self.synapses.table.getIndices( synType )
+            positions = self.getSynapsePositions()[ rows ]
+            placed = ~np.isnan( positions ).any( axis=1 )
+            entry = ( SpatialIndex( positions[ placed ] ), rows[ placed ] )
+            self.synapseIndices[ key ] = entry
+        return entry
+
+    def getAxonPoints( self ):
+        '''
+        Get the 3D points of the axon, falling back on the soma for cells
+        whose axon has no 3D points
+        '''
+        for secList in ( self.neurCell.axon, self.neurCell.soma ):
+            secIndices = [ self.geometry.getSectionIndex( sec ) for sec in secList ]
+            points = self.geometry.getSectionPoints( secIndices )
+            if len( points ):
+                return points
+        return np.empty( ( 0, 3 ) )
+
+    def selectInputSynapses( self, sourceCell, synType, conCount, strategy='fac',
+                             **strategyArgs ):
+        '''
+        Pick and initialise the synapses of this cell that a connection from
+        `sourceCell` will use; see `addChild`. Returns the synapse handles.
+        '''
         if( conCount == 0 ):
             print( "Warning: Adding child cell with no connected synapses!" )
-        # Start by getting the indices of the excitatory synapses
-        synapse = []
-        if synType == 1:
-            synapses = targetCell.synapses.inhSyn
-        else:
-            synapses = targetCell.synapses.excSyn
-
-        if conCount > len( synapses ):
+
+        numSynapses = len( self.synapses.table.getIndices( synType ) )
+        if conCount > numSynapses:
             print( "Warning! More connections requested than synapses exist! "
-                    "Requested %i, but cell has %i" %( conCount, len( synapses ) ) )
-            conCount = len( synapses ) - 1
-
-        synapseFacSum = {}
-        synapseDepSum = {}
-        synapseUseSum = {}
-        for synapse in synapses:
-            facSum = synapseFacSum.get( synapse.preCellId, 0.0 )
-            depSum = synapseDepSum.get( synapse.preCellId, 0.0 )
-            useSum = synapseUseSum.get( synapse.preCellId, 0.0 )
-
-            synapseFacSum[ synapse.preCellId ] = facSum + synapse.fac
-            synapseDepSum[ synapse.preCellId ] = depSum + synapse.dep
-            synapseUseSum[ synapse.preCellId ] = useSum + synapse.use
-
-        # Group by precell ID, and sort group by increasing `fac`
-        class synapseSortKeyWrapper( object ):
-
-            def synapseSortPredicate( self, synapseB ):
-                if ( self.obj.sectionlistId == 1 and self.obj.sectionlistId != 1 ):
-                    return -1
-                elif ( self.obj.sectionlistId != 1 and self.obj.sectionlistId == 1 ):
-                    return 1
-
-                return self.obj.fac - synapseB.fac
-                #if self.obj.preCellId == synapseB.preCellId:
-                #    #return self.obj.dep - synapseB.dep
-
-                #return synapseDepSum[ self.obj.preCellId ] - synapseDepSum[ synapseB.preCellId ]
-                #return synapseUseSum[ synapseB.preCellId ] - synapseUseSum[ self.obj.preCellId ]
-
-            def __init__(self, obj, *args):
-                self.obj = obj
-            def __lt__(self, other):
-                return self.synapseSortPredicate( other.obj ) < 0
-            def __gt__(self, other):
-                return self.synapseSortPredicate( other.obj ) > 0
-            def __eq__(self, other):
-                return self.synapseSortPredicate( other.obj ) == 0
-            def __le__(self, other):
-                return self.synapseSortPredicate( other.obj ) <= 0
-            def __ge__(self, other):
-                return self.synapseSortPredicate( other.obj ) >= 0
-            def __ne__(self, other):
-                return self.synapseSortPredicate( other.obj ) != 0
-
-        synapses.sort( key=synapseSortKeyWrapper )
-
-        # Randomly select synapses by shuffling and selecting the first
-        # N indices based on the connection proportion
-        #shuffle( synapses )
-        #conCount = len( synapses ) - 1
-        numBaselConn = len( [ syn for syn in synapses if syn.sectionlistId == 1 ] )
-        synapses = synapses[ 0 : conCount * 4 ] #numBaselConn // 2 ]
-        
-        for syn in synapses:
-            syn.initialise()
+                    "Requested %i, but cell has %i" %( conCount, numSynapses ) )
+            conCount = numSynapses - 1
+
+        synIndices = selectSynapses( strategy, sourceCell, self, synType,
+                                     conCount * 4, **strategyArgs )
+        return [ syn for syn in self.synapses.initialiseMany( synIndices )
+                    if syn.initialised ]
+
+    def createSpikeDetector( self, threshold=None ):
+        '''
+        Create a NetCon watching the somatic voltage with no target, for use
+        as this cell's spike source with ParallelContext.cell
+        '''
+        ourSoma = self.neurCell.soma[ 0 ]
+        self.spikeDetector = neuron.h.NetCon( ourSoma(0.5)._ref_v, None, sec=ourSoma )
+        if threshold:
+            self.spikeDetector.threshold = threshold
+        return self.spikeDetector
+
+    def addParentGid( self, sourceGid, pc, synType, conCount, weight, delay,
+                      strategy='fac', **strategyArgs ):
+        '''
+        Connect a cell that may live on another rank, identified by its gid,
+        to synapses of this cell through ParallelContext.gid_connect. The
+        arguments are as for `addChild`, except that the spike threshold
+        belongs to the source's spike detector. Strategies that need the
+        source cell's geometry can't be used.
+        '''
+        netCons = []
+        for syn in self.selectInputSynapses( None, synType, conCount,
+                                             strategy, **strategyArgs ):
+            netCon = pc.gid_connect( sourceGid, syn.synapse )
+            netCon.weight[ 0 ] = weight
+            netCon.delay = delay
+            netCons.append( netCon )
+        return netCons
 
+    def addChild( self, targetCell, synType, conCount, weight, delay, threshold=None,
+                  strategy='fac', **strategyArgs ):
+        ''' 
+        Connect to synapses of the target cell, of the excitatory (synType 0)
+        or inhibitory (synType 1) kind. Which synapses are used is decided by
+        `strategy`, a name from `SynapseSelection.selectionStrategies` or a
+        strategy function, which is passed any extra keyword arguments.
+
+        Returns the NetCons made, which only stay connected while they are
+        referenced; networks keep them in their Connectivity.
+        ''' 
+        netCons = []
+        for syn in targetCell.selectInputSynapses( self, synType, conCount,
+                                                   strategy, **strategyArgs ):
             # Create a new NetCon object to connect our cell to the target synapse
             ourSoma = self.neurCell.soma[ 0 ]
             netCon = neuron.h.NetCon( ourSoma(0.5)._ref_v, syn.synapse, sec=ourSoma )
 
-            # Append some info about the connection to our cell and the target cell
-            self.children.append( ( targetCell, netCon, synType ) )
-            targetCell.parents.append( ( self, netCon, synType ) )
-
             # Set the parameters of the NetCon
             netCon.weight[ 0 ] = weight
             netCon.delay = delay
             if threshold:
                 netCon.threshold = threshold
+            netCons.append( netCon )
+        return netCons
 
 
         # # Now connect up to the synapses
@@ -194,136 +244,237 @@ class pyCell():
 
 
 
+def synapseColumn( name ):
+    ''' Property reading one column of a synapse's row in the shared table '''
+    return property( lambda self: self.synapses.table.data[ self.index ][ name ].item(),
+                     doc="`%s` column of the synapse table" % name )
+
+
 class Synapse():
-    def __init__( self, cellRef ):
-        self.synapseId = None
+    '''
+    Lightweight handle to one row of a cell's synapse table. Handles are
+    only created for synapses that are used, through `Synapses.getSynapse`;
+    the synapse parameters are read straight from the shared table.
+    '''
+    __slots__ = ( 'synapses', 'index', 'synapse', 'section', 'initialised' )
+
+    synapseId = synapseColumn( 'synapseId' )
+    preCellId = synapseColumn( 'preCellId' )
+    preMType = synapseColumn( 'preMType' )
+    sectionlistId = synapseColumn( 'sectionlistId' )
+    sectionlistIdx = synapseColumn( 'sectionlistIdx' )
+    segX = synapseColumn( 'segX' )
+    synType = synapseColumn( 'synType' )
+    dep = synapseColumn( 'dep' )
+    fac = synapseColumn( 'fac' )
+    use = synapseColumn( 'use' )
+    tau_d = synapseColumn( 'tau_d' )
+    delay = synapseColumn( 'delay' )
+    weight = synapseColumn( 'weight' )
+
+    sectionListNames = { 0 : "somatic", 1 : "basal", 2 : "apical", 3 : "axonal" }
+
+    def __init__( self, synapses, index ):
+        self.synapses = synapses
+        self.index = index
         self.synapse = None
-        self.preCellId = None
-        self.preMType = None
-        self.sectionlistId = None
-        self.sectionlistIdx = None
-        self.segX = None
-        self.synType = None
-        self.dep = None
-        self.fac = None
-        self.use = None
-        self.tau_d = None
-        self.delay = None
-        self.weight = None
-        self.initialised = False
         self.section = None
-        self.sectionListName = ''
-        self.synapseTypeName = ''
-        self.synapseType = None
-        self.rnList = []
-        self.cellRef = cellRef
+        self.initialised = False
+
+    @property
+    def cellRef( self ):
+        return self.synapses.cellRef
+
+    @property
+    def rng( self ):
+        ''' The random stream driving this synapse's release '''
+        return self.synapses.randomStreams.getStream( self.synapses.gid,
+                                                      self.synapseId )
+
+    @property
+    def synapseType( self ):
+        # If synapse_type < 100 the synapse is inhibitory, otherwise
+        # excitatory
+        return 1 if self.synType < 100 else 0
+
+    @property
+    def synapseTypeName( self ):
+        return "inhibitory" if self.synapseType == 1 else "excitatory"
+
+    @property
+    def sectionListName( self ):
+        return Synapse.sectionListNames.get( self.sectionlistId, '' )
 
     def initialise( self ):
         '''
         Connect synapse to the given position on the cell
         '''
-        if self.initialised:
-            return
-
-        celRef = self.cellRef
-
-        # Create sectionref to the section the synapse will be placed on
-        if ( self.sectionlistId == 0 ):
-            self.section = neuron.h.SectionRef(
-                sec=celRef.soma[ self.sectionlistIdx ] )
-            self.sectionListName = "somatic"
-        elif ( self.sectionlistId == 1 ):
-            dList = list( celRef.dend )
-            self.section = neuron.h.SectionRef(
-                sec=celRef.dend[ self.sectionlistIdx ] )
-            self.sectionListName = "basal"
-        elif ( self.sectionlistId == 2 ):
-            self.section = neuron.h.SectionRef(
-                sec=celRef.apic[ self.sectionlistIdx ] )
-            self.sectionListName = "apical"
-        elif ( self.sectionlistId == 3 ):
-            self.section = neuron.h.SectionRef(
-                sec=celRef.axon[ self.sectionlistIdx ] )
-            self.sectionListName = "axonal"
-        else:
-            print( "Sectionlist ID %i not supported!" % self.sectionlistId )
-            return
-
-        # If synapse_type < 100 the synapse is inhibitory, otherwise
-        # excitatory
-        if self.synType < 100:
-            self.synapseTypeName = "inhibitory"
-            self.synapseType = 1
-            self.synapse = neuron.h.ProbGABAAB_EMS( self.segX, sec=self.section.sec )
-            self.synapse.tau_d_GABAA  = self.tau_d
-            rng = neuron.h.Random()
-            rng.MCellRan4( randint( 0, 700 )*100000+100, randint( 0, 7000 )+250 )
-            rng.lognormal(0.2, 0.1)
-            self.synapse.tau_r_GABAA = rng.repick()
-        else:
-            self.synapseTypeName = "excitatory"
-            self.synapseType = 0
-            self.synapse = neuron.h.ProbAMPANMDA_EMS( self.segX, sec=self.section.sec )
-            self.synapse.tau_d_AMPA = self.tau_d
-
-        
-        self.synapse.Use = abs( self.use )
-        self.synapse.Dep = abs( self.dep )
-        self.synapse.Fac = abs( self.fac )
-
-        # TODO - Add extra synconf handling here
-
-        rng = neuron.h.Random()
-        rng.MCellRan4( randint( 0, 700 )*100000+100, randint( 0, 7000 )+250 )
-        rng.uniform( 0, 1 )
-        self.synapse.setRNG( rng )         
-        self.rnList.append( rng )
-
-        self.initialised = True
+        if not self.initialised:
+            self.synapses.initialiseMany( [ self.index ] )
 
 
 
 class Synapses():
-    def __init__( self, synInfoPath, cellRef ):
-        self.synapseList = []
-        self.excSyn = []
-        self.inhSyn = []
-        synDataList = []
-        with open( synInfoPath, 'r' ) as synFile:
-            # Load the synapse data, but don't create any yet
-            import csv
-            synReader = csv.reader( synFile, delimiter='\t' )
-            synDataList = list( synReader )
-
-        if not synDataList:
-            print( "Error: Could not load synapse file %s " % synInfoPath )
-            return
-
-        # Truncate to get just the data
-        synDataList = synDataList[ 1: ]
-
-        # Row/column count in header
-        numSynapse = int( len( synDataList ) )
-        numCols = int(  len( synDataList[ 0 ] ) )
-
-        for idx, synData in enumerate( synDataList ):
-            newSyn = Synapse( cellRef )
-            newSyn.synapseId = int( synData[ 0 ] )
-            newSyn.preCellId = int( synData[ 1 ] )
-            newSyn.preMType = int( synData[ 2 ] )
-            newSyn.sectionlistId = int( synData[ 3 ] )
-            newSyn.sectionlistIdx = int( synData[ 4 ] )
-            newSyn.segX = float( synData[ 5 ] )
-            newSyn.synType = int( synData[ 6 ] )
-            newSyn.dep = float( synData[ 7 ] )
-            newSyn.fac = float( synData[ 8 ] )
-            newSyn.use = float( synData[ 9 ] )
-            newSyn.tau_d = float( synData[ 10 ] )
-            newSyn.delay = float( synData[ 11 ] )
-            newSyn.weight = float( synData[ 12 ] )
-            self.synapseList.append( newSyn )
-          #  print( "Loading synapse %i" % newSyn.synapseId )
-            if newSyn.synType < 100:
-                self.inhSyn.append( newSyn )
+    '''
+    The synapses of one cell. The synapse data itself lives in a
+    `SynapseTable` shared by all cells of the same type; this only keeps
+    the handles of synapses that have been requested from it.
+    '''
+    sectionListAttrs = { 0 : "soma", 1 : "dend", 2 : "apic", 3 : "axon" }
+
+    def __init__( self, synInfoPath, cellRef, randomStreams=None, gid=0 ):
+        self.cellRef = cellRef
+        self.gid = gid
+        if randomStreams is None:
+            randomStreams = RandomStreams.getDefault()
+        self.randomStreams = randomStreams
+        self.table = SynapseTable.load( synInfoPath )
+        self.handles = {}
+        self.sectionRefs = {}
+        self.geometrySections = None
+
+    def __len__( self ):
+        return len( self.table )
+
+    def getSynapse( self, index ):
+        ''' Get the handle for a row of the synapse table, creating it if needed '''
+        index = int( index )
+        syn = self.handles.get( index, None )
+        if syn is None:
+            syn = Synapse( self, index )
+            self.handles[ index ] = syn
+        return syn
+
+    def getSynapses( self, indices ):
+        return [ self.getSynapse( index ) for index in indices ]
+
+    def getGeometrySections( self, geometry ):
+        '''
+        Get, for every synapse in the table, the index in `geometry.sections`
+        of the section it sits on, or -1 for unsupported section lists
+        '''
+        if self.geometrySections is None:
+            data = self.table.data
+            secKeys, inverse = np.unique( np.stack( ( data[ 'sectionlistId' ],
+                                                      data[ 'sectionlistIdx' ] ), axis=1 ),
+                                          axis=0, return_inverse=True )
+            keyToGeometry = np.full( len( secKeys ), -1, dtype=np.int64 )
+            for i, ( sectionlistId, sectionlistIdx ) in enumerate( secKeys.tolist() ):
+                listName = Synapses.sectionListAttrs.get( sectionlistId, None )
+                if listName is not None:
+                    sec = getattr( self.cellRef, listName )[ sectionlistIdx ]
+                    keyToGeometry[ i ] = geometry.getSectionIndex( sec )
+            self.geometrySections = keyToGeometry[ inverse.reshape( -1 ) ]
+        return self.geometrySections
+
+    def getPositions( self, geometry ):
+        ''' Get the xyz position of every synapse in the table '''
+        secIndices = self.getGeometrySections( geometry )
+        positions = np.full( ( len( secIndices ), 3 ), np.nan )
+        supported = secIndices >= 0
+        positions[ supported ] = geometry.interpolate( secIndices[ supported ],
+                                                       self.table.data[ 'segX' ][ supported ] )
+        return positions
+
+    def getSectionRef( self, sectionlistId, sectionlistIdx ):
+        '''
+        Get a SectionRef to a section of the cell, by section list ID and
+        index. Refs are made once and shared by all synapses on the section.
+        Returns None for unsupported section lists.
+        '''
+        key = ( sectionlistId, sectionlistIdx )
+        secRef = self.sectionRefs.get( key, None )
+        if secRef is None:
+            listName = Synapses.sectionListAttrs.get( sectionlistId, None )
+            if listName is None:
+                return None
+            secArray = getattr( self.cellRef, listName )
+            secRef = neuron.h.SectionRef( sec=secArray[ sectionlistIdx ] )
+            self.sectionRefs[ key ] = secRef
+        return secRef
+
+    def initialiseMany( self, indices ):
+        '''
+        Create the point processes for a batch of synapses, given as row
+        indices into the synapse table, and return their handles. Synapses
+        are grouped by section so each section is only looked up once.
+        Synapses on unsupported section lists are left uninitialised.
+        '''
+        handles = self.getSynapses( indices )
+        pending = np.unique( [ syn.index for syn in handles if not syn.initialised ] )
+        if len( pending ) == 0:
+            return handles
+
+        # Pull all parameters for the batch out of the table in one go,
+        # ordered by section
+        rows = self.table.data[ pending ]
+        order = np.lexsort( ( rows[ 'sectionlistIdx' ], rows[ 'sectionlistId' ] ) )
+
+        # GABA rise times are drawn up front from the counter-based streams
+        tauRise = self.randomStreams.lognormal( self.gid, rows[ 'synapseId' ],
+                                                0.2, 0.1 )
+
+        curSection = None
+        secRef = None
+        for index, synData, tauR in zip( pending[ order ].tolist(),
+                                         rows[ order ].tolist(),
+                                         tauRise[ order ].tolist() ):
+            synapseId, _, _, sectionlistId, sectionlistIdx, segX, synType, \
+                dep, fac, use, tau_d, _, _ = synData
+
+            if ( sectionlistId, sectionlistIdx ) != curSection:
+                curSection = ( sectionlistId, sectionlistIdx )
+                secRef = self.getSectionRef( sectionlistId, sectionlistIdx )
+                if secRef is None:
+                    print( "Sectionlist ID %i not supported!" % sectionlistId )
+            if secRef is None:
+                continue
+
+            syn = self.handles[ index ]
+            syn.section = secRef
+
+            # If synapse_type < 100 the synapse is inhibitory, otherwise
+            # excitatory
+            if synType < 100:
+                synapse = neuron.h.ProbGABAAB_EMS( segX, sec=secRef.sec )
+                synapse.tau_d_GABAA = tau_d
+                synapse.tau_r_GABAA = tauR
             else:
-                self.excSyn.append( newSyn )
+                synapse = neuron.h.ProbAMPANMDA_EMS( segX, sec=secRef.sec )
+                synapse.tau_d_AMPA = tau_d
+
+            synapse.Use = abs( use )
+            synapse.Dep = abs( dep )
+            synapse.Fac = abs( fac )
+
+            # TODO - Add extra synconf handling here
+
+            synapse.setRNG( self.randomStreams.getStream( self.gid, synapseId ) )
+
+            syn.synapse = synapse
+            syn.initialised = True
+
+        return handles
+
+    @property
+    def excIndices( self ):
+        return self.table.excIndices
+
+    @property
+    def inhIndices( self ):
+        return self.table.inhIndices
+
+    # The list views below create a handle for every synapse they contain,
+    # so prefer working with indices where possible
+
+    @property
+    def synapseList( self ):
+        return self.getSynapses( range( len( self.table ) ) )
+
+    @property
+    def excSyn( self ):
+        return self.getSynapses( self.table.excIndices )
+
+    @property
+    def inhSyn( self ):
+        return self.getSynapses( self.table.inhIndices )
@@ -0,0 +1,80 @@
+'''
+Invalidation of the cached model base index.
+'''
+import os
+import subprocess
+import sys
+import pytest
+from neurpy.ModelIndex import ModelIndex
+from neurpy.SynapseTable import loadSynapseTable
+
+repoRoot = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+
+def makeCell( modelRoot, path, templateName ):
+    cellRoot = os.path.join( modelRoot, path )
+    os.makedirs( os.path.join( cellRoot, "synapses" ) )
+    os.makedirs( os.path.join( cellRoot, "morphology" ) )
+    with open( os.path.join( cellRoot, "template.hoc" ), 'w' ) as tmplFile:
+        tmplFile.write( "// cell\nbegintemplate %s\nendtemplate %s\n" % ( templateName, templateName ) )
+    with open( os.path.join( cellRoot, "synapses", "synapses.tsv" ), 'w' ) as synFile:
+        synFile.write( "header\n" + "\t".join( [ "1" ] * 13 ) + "\n" )
+    with open( os.path.join( cellRoot, "morphology", "cell.asc" ), 'w' ) as morphFile:
+        morphFile.write( "( 1 2 3 4 )\n( 1 2 3 4 )\n" )
+    with open( os.path.join( cellRoot, "biophysics.hoc" ), 'w' ) as biophysFile:
+        biophysFile.write( "forsec $o1.all {\ninsert pas\n}\n" )
+    return cellRoot
+
+
+@pytest.fixture
+def modelRoot( tmp_path, monkeypatch ):
+    monkeypatch.setenv( 'XDG_CACHE_HOME', str( tmp_path / "cache" ) )
+    root = str( tmp_path / "modelBase" )
+    makeCell( root, "L1_A", "cADpyr_L1A" )
+    makeCell( root, os.path.join( "layer5", "L5_B" ), "bNAC_L5B" )
+    return root
+
+
+def test_indexEntries( modelRoot ):
+    index = ModelIndex.load( modelRoot )
+    assert sorted( index.cells ) == [ 'L1_A', 'L5_B' ]
+    assert index.getTemplateName( 'L5_B' ) == 'bNAC_L5B'
+    assert index.getEntry( 'L1_A' )[ 'morphologyPoints' ] == 2
+    assert index.getPath( 'L5_B', 'synapseFile' ) == \
+        os.path.join( os.path.realpath( modelRoot ), "layer5", "L5_B", "synapses", "synapses.tsv" )
+
+
+def test_runTimeFilesKeepIndexValid( modelRoot ):
+    index = ModelIndex.load( modelRoot )
+    assert index.isValid()
+
+    # The compiled synapse cache is written next to each synapses.tsv
+    for cellType in index.cells:
+        loadSynapseTable( index.getPath( cellType, 'synapseFile' ) )
+        assert os.path.exists( os.path.splitext( index.getPath( cellType, 'synapseFile' ) )[ 0 ] + ".npy" )
+    # cellnamegen writes cellname.txt into every cell directory
+    subprocess.run( [ sys.executable, os.path.join( repoRoot, "NeurGen", "cellnamegen.py" ),
+                      modelRoot + os.sep ], check=True, env=os.environ.copy() )
+    assert os.path.exists( os.path.join( modelRoot, "L1_A", "cellname.txt" ) )
+
+    assert index.isValid()
+    assert ModelIndex.load( modelRoot ).isValid()
+
+
+def test_changesInvalidateIndex( modelRoot ):
+    index = ModelIndex.load( modelRoot )
+
+    # A new cell type
+    makeCell( modelRoot, os.path.join( "layer5", "L5_C" ), "cNAC_L5C" )
+    assert not index.isValid()
+    index = ModelIndex.load( modelRoot )
+    assert 'L5_C' in index
+
+    # An edited template
+    templatePath = index.getPath( 'L1_A', 'templateFile' )
+    stat = os.stat( templatePath )
+    with open( templatePath, 'w' ) as tmplFile:
+        tmplFile.write( "begintemplate Renamed\n" )
+    os.utime( templatePath, ns=( stat.st_atime_ns, stat.st_mtime_ns + 10**9 ) )
+    assert not index.isValid()
+    assert ModelIndex.load( modelRoot ).getTemplateName( 'L1_A' ) == 'Renamed'
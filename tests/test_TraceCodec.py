@@ -0,0 +1,72 @@
+'''
+Reconstruction error bounds of the trace codecs.
+'''
+import numpy as np
+import pytest
+from neurpy.TraceCodec import createCodec, DeltaCodec
+
+codecSpecs = [ 'raw', 'float32',
+               { 'name' : 'int16', 'resolution' : 0.01 },
+               { 'name' : 'int16', 'resolution' : 0.005 },
+               { 'name' : 'delta', 'resolution' : 0.01 },
+               { 'name' : 'delta', 'resolution' : 1e-4 } ]
+
+
+def makeVoltageTrace( numSamples=20000, seed=0 ):
+    ''' Resting potential drifting with noise, and a spike every 100 ms at 0.1 ms steps '''
+    rng = np.random.default_rng( seed )
+    t = np.arange( numSamples ) * 0.1
+    v = -70.0 + 5.0 * np.sin( t / 30.0 ) + np.cumsum( rng.normal( 0.0, 0.002, numSamples ) )
+    v[ ( t % 100.0 ) < 1.0 ] += 100.0
+    return v
+
+
+@pytest.mark.parametrize( 'spec', codecSpecs, ids=str )
+def test_errorWithinBound( spec ):
+    codec = createCodec( spec )
+    v = makeVoltageTrace()
+    decoded = codec.decode( codec.encode( v ), len( v ) )
+    assert decoded.dtype == np.float64
+    assert np.max( np.abs( decoded - v ) ) <= codec.maxError( v )
+    # verify() applies the same check
+    codec.verify( v, codec.encode( v ) )
+
+
+@pytest.mark.parametrize( 'spec', codecSpecs, ids=str )
+def test_emptyColumn( spec ):
+    codec = createCodec( spec )
+    empty = np.empty( 0 )
+    assert len( codec.decode( codec.encode( empty ), 0 ) ) == 0
+
+
+@pytest.mark.parametrize( 'name, limit', [ ( 'int16', 32767 ), ( 'delta', 2147483647 ) ] )
+def test_outOfRangeRaises( name, limit ):
+    resolution = 0.01
+    codec = createCodec( { 'name' : name, 'resolution' : resolution } )
+    # Largest value held is fine, one step beyond isn't, either sign
+    codec.encode( np.array( [ limit * resolution, -limit * resolution ] ) )
+    for value in ( ( limit + 1 ) * resolution, -( limit + 1 ) * resolution ):
+        with pytest.raises( ValueError ):
+            codec.encode( np.array( [ 0.0, value ] ) )
+
+
+@pytest.mark.parametrize( 'name', [ 'int16', 'delta' ] )
+def test_nanRaises( name ):
+    codec = createCodec( name )
+    with pytest.raises( ValueError ):
+        codec.encode( np.array( [ -65.0, np.nan ] ) )
+
+
+def test_deltaWrapAround():
+    # Consecutive steps far enough apart that their differences overflow int32
+    codec = DeltaCodec( resolution=1.0 )
+    x = np.array( [ 2e9, -2e9, 2e9, 2147483647.0, -2147483647.0, 0.0 ] )
+    steps = np.rint( x ).astype( np.int64 )
+    assert np.max( np.abs( np.diff( steps ) ) ) > np.iinfo( np.int32 ).max
+    decoded = codec.decode( codec.encode( x ), len( x ) )
+    assert np.max( np.abs( decoded - x ) ) <= codec.maxError( x )
+
+
+def test_unknownCodecRaises():
+    with pytest.raises( ValueError ):
+        createCodec( 'float16' )